@@ -15,10 +15,11 @@ import os
 import traceback
 import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from google.cloud import firestore
-from google import genai
+
+from llm_gateway import LLMGateway, SemanticReplyCache
 
 
 # =====================================================
@@ -30,12 +31,34 @@ PROJECT_ID: str = os.getenv(
 LOCATION: str = os.getenv("GCP_LOCATION", "us-central1")
 
 GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# Budget for one Gemini reply; past it the caller gets ACK_TEMPLATE
+LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", "8"))
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Priority admission: these priorities get ACK_TEMPLATE instead of a model
+# reply once LLM_SHED_IN_FLIGHT calls are running or LLM_SHED_WAITING wait
+LLM_SHED_PRIORITIES: List[str] = os.getenv("LLM_SHED_PRIORITIES", "P3,P4").split(",")
+LLM_SHED_IN_FLIGHT: int = int(os.getenv("LLM_SHED_IN_FLIGHT", "4"))
+LLM_SHED_WAITING: int = int(os.getenv("LLM_SHED_WAITING", "1"))
+
+ACK_TEMPLATE: str = (
+    "Your {priority} issue has been logged. "
+    "Our support team will respond within {response_mins} minutes."
+)
+
 EMBED_MODEL: str = os.getenv("EMBED_MODEL", "text-embedding-004")
 
 ENABLE_EMBEDDINGS: bool = (
     os.getenv("ENABLE_EMBEDDINGS", "false").lower() == "true"
 )
 
+# Semantic reply cache (ENABLE_EMBEDDINGS): an issue whose embedding is at
+# least REPLY_CACHE_THRESHOLD cosine-similar to a recent one reuses its reply
+REPLY_CACHE_THRESHOLD: float = float(os.getenv("REPLY_CACHE_THRESHOLD", "0.92"))
+REPLY_CACHE_TTL_SECONDS: float = float(os.getenv("REPLY_CACHE_TTL_SECONDS", "600"))
+REPLY_CACHE_MAX_ENTRIES: int = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "256"))
+
 ISSUES_COL: str = os.getenv("ISSUES_COL", "issues")
 USERS_COL: str = os.getenv("USERS_COL", "users")
 
@@ -47,6 +70,29 @@ SLA_POLICY: Dict[str, Dict[str, int]] = {
 }
 
 db = firestore.Client(project=PROJECT_ID)
+reply_cache = (
+    SemanticReplyCache(
+        threshold=REPLY_CACHE_THRESHOLD,
+        ttl_seconds=REPLY_CACHE_TTL_SECONDS,
+        max_entries=REPLY_CACHE_MAX_ENTRIES,
+    )
+    if ENABLE_EMBEDDINGS
+    else None
+)
+llm = LLMGateway(
+    project=PROJECT_ID,
+    location=LOCATION,
+    model=GEMINI_MODEL,
+    timeout_seconds=LLM_TIMEOUT_SECONDS,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    # Most urgent first, by SLA response time
+    priority_order=sorted(SLA_POLICY, key=lambda p: SLA_POLICY[p]["response_mins"]),
+    shed_priorities=LLM_SHED_PRIORITIES,
+    shed_in_flight=LLM_SHED_IN_FLIGHT,
+    shed_waiting=LLM_SHED_WAITING,
+    embed_model=EMBED_MODEL,
+    reply_cache=reply_cache,
+)
 
 
 # =====================================================
@@ -82,39 +128,32 @@ def json_response(payload: Dict[str, Any]):
         {
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
             "Access-Control-Allow-Headers": "Content-Type, Authorization",
         },
     )
 
 
-def vertex_client() -> genai.Client:
-    """Create Vertex AI Gemini client using ADC."""
-    return genai.Client(
-        vertexai=True,
-        project=PROJECT_ID,
-        location=LOCATION,
+def ack_reply(priority: str) -> str:
+    """Templated acknowledgement used when the model is skipped."""
+    policy = SLA_POLICY.get(priority, SLA_POLICY["P3"])
+    return ACK_TEMPLATE.format(priority=priority, response_mins=policy["response_mins"])
+
+
+def gemini_reply(issue_text: str, priority: str) -> str:
+    """Generate a Gemini response, admitted by priority. Never raises."""
+    return llm.generate(
+        (
+            "You are a support assistant. "
+            "Provide a concise and helpful response.\n\n"
+            f"Issue: {issue_text}"
+        ),
+        fallback=ack_reply(priority),
+        priority=priority,
+        cache_text=issue_text,
     )
 
 
-def gemini_reply(issue_text: str) -> str:
-    """Generate a safe Gemini response. Never raises."""
-    try:
-        client = vertex_client()
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=(
-                "You are a support assistant. "
-                "Provide a concise and helpful response.\n\n"
-                f"Issue: {issue_text}"
-            ),
-        )
-        return (response.text or "").strip() or "Your issue has been logged."
-    except Exception:
-        traceback.print_exc()
-        return "Your issue has been logged. Our support team will follow up."
-
-
 def upsert_user(reporter_id: str) -> None:
     """Create or update a user record."""
     db.collection(USERS_COL).document(reporter_id).set(
@@ -160,6 +199,10 @@ def submit_issue(request):
     if request.method == "OPTIONS":
         return json_response({})
 
+    # LLM gateway load and per-priority outcomes (shed rate) for monitoring
+    if request.method == "GET":
+        return json_response({"llm_gateway": llm.stats()})
+
     try:
         body = request.get_json(silent=True) or {}
 
@@ -184,7 +227,7 @@ def submit_issue(request):
 
         upsert_user(reporter_id)
         issue_id = create_issue(reporter_id, issue_text, priority)
-        assistant_reply = gemini_reply(issue_text)
+        assistant_reply = gemini_reply(issue_text, priority)
 
         return json_response(
             {
@@ -0,0 +1,401 @@
+"""
+LLM Gateway
+Shared Gemini access for the issue APIs
+
+Guarantees:
+- One Vertex AI client per process (HTTP connections are reused)
+- At most max_concurrency model calls in flight, most urgent priority first
+- A reply within the timeout budget, or the caller's fallback
+- Optional reuse of replies to semantically equivalent issues
+- Never raises
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from google import genai
+from google.genai import types
+
+OUTCOMES = ("reply", "cached", "shed", "busy", "timeout", "error", "empty")
+
+
+class SemanticReplyCache:
+    """
+    In-memory vector index of recent model replies. get() returns the
+    reply stored for the most similar live issue when its cosine
+    similarity reaches threshold.
+
+    Vectors are normalized on insert, so cosine is a dot product. Lookups
+    scan every entry (with numpy when installed): sized for the few
+    hundred issues of an incident spike, not a corpus.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        ttl_seconds: float = 600.0,
+        max_entries: int = 256,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+
+        # (expires_at, unit vector, reply); oldest first, so expired
+        # entries are always at the left
+        self._entries: Deque[Tuple[float, List[float], str]] = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, vector: Sequence[float]) -> Optional[str]:
+        query = _unit(vector)
+        with self._lock:
+            self._purge()
+            entries = list(self._entries)
+
+        best, reply = _best_match(query, entries)
+        if reply is not None and best >= self.threshold:
+            self.hits += 1
+            return reply
+
+        self.misses += 1
+        return None
+
+    def put(self, vector: Sequence[float], reply: str) -> None:
+        entry = (time.monotonic() + self.ttl_seconds, _unit(vector), reply)
+        with self._lock:
+            self._purge()
+            self._entries.append(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        while self._entries and self._entries[0][0] <= now:
+            self._entries.popleft()
+
+
+def _unit(vector: Sequence[float]) -> List[float]:
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector] if norm else list(vector)
+
+
+def _best_match(
+    query: List[float], entries: List[Tuple[float, List[float], str]]
+) -> Tuple[float, Optional[str]]:
+    """Highest cosine similarity among entries and its reply."""
+    if not entries:
+        return 0.0, None
+
+    try:
+        import numpy as np
+    except ImportError:
+        scores = [sum(q * v for q, v in zip(query, e[1])) for e in entries]
+    else:
+        scores = (np.asarray([e[1] for e in entries]) @ np.asarray(query)).tolist()
+
+    i = max(range(len(scores)), key=scores.__getitem__)
+    return scores[i], entries[i][2]
+
+
+class LLMGateway:
+    """
+    Bounded, deadline-aware wrapper around generate_content.
+
+    Calls wait for a slot in priority order (priority_order, most urgent
+    first; unknown priorities rank last). Priorities in shed_priorities
+    are refused outright once shed_in_flight calls are running or
+    shed_waiting calls are queued, keeping the remaining capacity for
+    urgent tickets.
+
+    A call that is shed, or cannot get a slot or an answer within its
+    budget, returns the fallback immediately. The model call itself is
+    left to finish in the background (the HTTP timeout bounds it) and
+    keeps its slot until then, so a slow model cannot pile up unbounded
+    work.
+
+    With a reply_cache and embed_model, a call passing cache_text first
+    looks for the reply to a semantically equivalent issue; hits skip
+    admission and the model entirely. The lookup is skipped (the call goes
+    straight to admission) while max_concurrency embeddings are already
+    running, so a slow embedding endpoint cannot build an unbounded queue.
+    """
+
+    def __init__(
+        self,
+        project: str,
+        location: str,
+        model: str,
+        timeout_seconds: float = 8.0,
+        max_concurrency: int = 8,
+        priority_order: Sequence[str] = (),
+        shed_priorities: Iterable[str] = (),
+        shed_in_flight: Optional[int] = None,
+        shed_waiting: int = 1,
+        embed_model: Optional[str] = None,
+        reply_cache: Optional[SemanticReplyCache] = None,
+        embed_timeout_seconds: float = 1.0,
+    ):
+        self.project = project
+        self.location = location
+        self.model = model
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrency = max_concurrency
+
+        self.priority_order = list(priority_order)
+        self.shed_priorities = set(shed_priorities)
+        self.shed_in_flight = max_concurrency if shed_in_flight is None else shed_in_flight
+        self.shed_waiting = shed_waiting
+
+        self.embed_model = embed_model
+        self.reply_cache = reply_cache
+        self.embed_timeout_seconds = embed_timeout_seconds
+
+        self._client: Optional[genai.Client] = None
+        self._client_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="llm"
+        )
+        # Separate pool: embeddings must not queue behind slow model calls.
+        # _embeds_running never exceeds its workers, so nothing queues.
+        self._embed_executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="llm-embed"
+        )
+        self._embed_lock = threading.Lock()
+        self._embeds_running = 0
+        self._embeds_skipped = 0
+
+        # Admission state, guarded by _cond
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting: list = []
+        self._tickets = itertools.count()
+
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def client(self) -> genai.Client:
+        """Process-wide Vertex AI Gemini client using ADC."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = genai.Client(
+                        vertexai=True,
+                        project=self.project,
+                        location=self.location,
+                        http_options=types.HttpOptions(
+                            timeout=int(self.timeout_seconds * 1000)
+                        ),
+                    )
+        return self._client
+
+    def generate(
+        self,
+        prompt: str,
+        fallback: str,
+        priority: str = "",
+        timeout_seconds: Optional[float] = None,
+        cache_text: Optional[str] = None,
+    ) -> str:
+        """Model reply within the budget, else fallback. Never raises."""
+        started = time.monotonic()
+        budget = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        deadline = started + budget
+
+        vector = None
+        if cache_text and self.reply_cache is not None and self.embed_model:
+            vector = self._embed(cache_text, deadline)
+            cached = self.reply_cache.get(vector) if vector else None
+            if cached is not None:
+                self._record(priority, "cached", started)
+                return cached
+
+        outcome = self._admit(priority, deadline)
+        text = ""
+        if outcome is None:
+            text, outcome = self._run(prompt, deadline)
+
+        if outcome == "reply" and vector:
+            self.reply_cache.put(vector, text)
+
+        self._record(priority, outcome, started)
+        return text if outcome == "reply" else fallback
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current load and per-priority outcome counts, shed rate and
+        latency (average and worst, ms).
+        """
+        with self._stats_lock:
+            priorities = {p: dict(counts) for p, counts in self._stats.items()}
+        for counts in priorities.values():
+            counts["shed_rate"] = round(counts["shed"] / counts["calls"], 4)
+            counts["avg_latency_ms"] = round(counts.pop("latency_ms") / counts["calls"], 1)
+            counts["max_latency_ms"] = round(counts["max_latency_ms"], 1)
+
+        return {
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiting),
+            "priorities": priorities,
+            "reply_cache": self.reply_cache.stats() if self.reply_cache else None,
+            "embeds_running": self._embeds_running,
+            "embeds_skipped": self._embeds_skipped,
+        }
+
+    # -------------------------------------------------
+    # Admission
+    # -------------------------------------------------
+    def _rank(self, priority: str) -> int:
+        if priority in self.priority_order:
+            return self.priority_order.index(priority)
+        return len(self.priority_order)
+
+    def _admit(self, priority: str, deadline: float) -> Optional[str]:
+        """Take a slot; None when admitted, else the refusal outcome."""
+        with self._cond:
+            if priority in self.shed_priorities and (
+                self._in_flight >= self.shed_in_flight
+                or len(self._waiting) >= self.shed_waiting
+            ):
+                return "shed"
+
+            ticket = (self._rank(priority), next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while (
+                    self._waiting[0] != ticket
+                    or self._in_flight >= self.max_concurrency
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "busy"
+                    self._cond.wait(remaining)
+
+                self._in_flight += 1
+                return None
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # The head of the queue may have changed
+                self._cond.notify_all()
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    # -------------------------------------------------
+    # Model call
+    # -------------------------------------------------
+    def _run(self, prompt: str, deadline: float):
+        try:
+            future = self._executor.submit(self._generate, prompt)
+        except Exception:
+            self._release()
+            traceback.print_exc()
+            return "", "error"
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            text = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            return "", "timeout"
+        except Exception:
+            traceback.print_exc()
+            return "", "error"
+
+        return text, "reply" if text else "empty"
+
+    def _embed(self, text: str, deadline: float) -> Optional[List[float]]:
+        """Embedding of text, or None when it fails, is too slow or every
+        embed worker is busy."""
+        with self._embed_lock:
+            if self._embeds_running >= self.max_concurrency:
+                self._embeds_skipped += 1
+                return None
+            self._embeds_running += 1
+
+        timeout = min(self.embed_timeout_seconds, deadline - time.monotonic())
+        try:
+            future = self._embed_executor.submit(self._embed_content, text)
+        except Exception:
+            self._embed_done()
+            traceback.print_exc()
+            return None
+        future.add_done_callback(lambda _: self._embed_done())
+
+        try:
+            return future.result(timeout=max(timeout, 0))
+        except FutureTimeout:
+            return None
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _embed_done(self) -> None:
+        with self._embed_lock:
+            self._embeds_running -= 1
+
+    def _embed_content(self, text: str) -> List[float]:
+        response = self.client().models.embed_content(
+            model=self.embed_model,
+            contents=text,
+        )
+        return list(response.embeddings[0].values)
+
+    def _generate(self, prompt: str) -> str:
+        response = self.client().models.generate_content(
+            model=self.model,
+            contents=prompt,
+        )
+        return (response.text or "").strip()
+
+    # -------------------------------------------------
+    # Metrics
+    # -------------------------------------------------
+    def _record(self, priority: str, outcome: str, started: float) -> None:
+        priority = priority or "unknown"
+        latency_ms = (time.monotonic() - started) * 1000
+        with self._stats_lock:
+            counts = self._stats.setdefault(
+                priority,
+                {"calls": 0, **{o: 0 for o in OUTCOMES}, "latency_ms": 0.0, "max_latency_ms": 0.0},
+            )
+            counts["calls"] += 1
+            counts[outcome] += 1
+            counts["latency_ms"] += latency_ms
+            counts["max_latency_ms"] = max(counts["max_latency_ms"], latency_ms)
+            shed_rate = counts["shed"] / counts["calls"]
+
+        # One structured line per call; Cloud Logging turns it into
+        # jsonPayload fields for log-based metrics (shed rate per priority)
+        print(
+            json.dumps(
+                {
+                    "severity": "WARNING" if outcome == "shed" else "INFO",
+                    "message": "llm_gateway",
+                    "priority": priority,
+                    "outcome": outcome,
+                    "latency_ms": round(latency_ms, 1),
+                    "shed_rate": round(shed_rate, 4),
+                }
+            ),
+            flush=True,
+        )
@@ -15,10 +15,11 @@ import os
 import traceback
 import uuid
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from google.cloud import firestore
-from google import genai
+
+from llm_gateway import LLMGateway
 
 
 # =====================================================
@@ -31,6 +32,21 @@ LOCATION: str = os.getenv("GCP_LOCATION", "us-central1")
 
 GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
+# Budget for one Gemini reply; past it the caller gets ACK_TEMPLATE
+LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", "8"))
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Priority admission: these priorities get ACK_TEMPLATE instead of a model
+# reply once LLM_SHED_IN_FLIGHT calls are running or LLM_SHED_WAITING wait
+LLM_SHED_PRIORITIES: List[str] = os.getenv("LLM_SHED_PRIORITIES", "P3,P4").split(",")
+LLM_SHED_IN_FLIGHT: int = int(os.getenv("LLM_SHED_IN_FLIGHT", "4"))
+LLM_SHED_WAITING: int = int(os.getenv("LLM_SHED_WAITING", "1"))
+
+ACK_TEMPLATE: str = (
+    "Your {priority} issue has been logged. "
+    "Our support team will respond within {response_mins} minutes."
+)
+
 ISSUES_COL: str = os.getenv("ISSUES_COL", "issues")
 USERS_COL: str = os.getenv("USERS_COL", "users")
 
@@ -42,6 +58,18 @@ SLA_POLICY: Dict[str, Dict[str, int]] = {
 }
 
 db = firestore.Client(project=PROJECT_ID)
+llm = LLMGateway(
+    project=PROJECT_ID,
+    location=LOCATION,
+    model=GEMINI_MODEL,
+    timeout_seconds=LLM_TIMEOUT_SECONDS,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    # Most urgent first, by SLA response time
+    priority_order=sorted(SLA_POLICY, key=lambda p: SLA_POLICY[p]["response_mins"]),
+    shed_priorities=LLM_SHED_PRIORITIES,
+    shed_in_flight=LLM_SHED_IN_FLIGHT,
+    shed_waiting=LLM_SHED_WAITING,
+)
 
 
 # =====================================================
@@ -72,39 +100,31 @@ def json_response(payload: Dict[str, Any]):
         {
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
             "Access-Control-Allow-Headers": "Content-Type, Authorization",
         },
     )
 
 
-def vertex_client() -> genai.Client:
-    """Create Vertex AI Gemini client."""
-    return genai.Client(
-        vertexai=True,
-        project=PROJECT_ID,
-        location=LOCATION,
+def ack_reply(priority: str) -> str:
+    """Templated acknowledgement used when the model is skipped."""
+    policy = SLA_POLICY.get(priority, SLA_POLICY["P3"])
+    return ACK_TEMPLATE.format(priority=priority, response_mins=policy["response_mins"])
+
+
+def gemini_reply(issue_text: str, priority: str) -> str:
+    """Generate a Gemini response, admitted by priority. Never raises."""
+    return llm.generate(
+        (
+            "You are a support assistant. "
+            "Provide a concise and helpful response.\n\n"
+            f"Issue: {issue_text}"
+        ),
+        fallback=ack_reply(priority),
+        priority=priority,
     )
 
 
-def gemini_reply(issue_text: str) -> str:
-    """Generate a safe Gemini response."""
-    try:
-        client = vertex_client()
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=(
-                "You are a support assistant. "
-                "Provide a concise and helpful response.\n\n"
-                f"Issue: {issue_text}"
-            ),
-        )
-        return (response.text or "").strip() or "Your issue has been logged."
-    except Exception:
-        traceback.print_exc()
-        return "Your issue has been logged. Our support team will follow up."
-
-
 def upsert_user(reporter_id: str) -> None:
     """Create or update a user record."""
     db.collection(USERS_COL).document(reporter_id).set(
@@ -148,6 +168,10 @@ def submit_issue(request):
     if request.method == "OPTIONS":
         return json_response({})
 
+    # LLM gateway load and per-priority outcomes (shed rate) for monitoring
+    if request.method == "GET":
+        return json_response({"llm_gateway": llm.stats()})
+
     try:
         body = request.get_json(silent=True) or {}
 
@@ -172,7 +196,7 @@ def submit_issue(request):
 
         upsert_user(reporter_id)
         issue_id = create_issue(reporter_id, issue_text, priority)
-        assistant_reply = gemini_reply(issue_text)
+        assistant_reply = gemini_reply(issue_text, priority)
 
         return json_response(
             {
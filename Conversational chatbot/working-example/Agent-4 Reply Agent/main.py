@@ -21,7 +21,8 @@ from google.cloud import firestore
 from google.cloud import pubsub_v1
 from google.cloud import tasks_v2
 from google.protobuf import timestamp_pb2
-import google.genai as genai
+
+from llm_gateway import LLMGateway
 
 
 # =====================================================
@@ -32,6 +33,21 @@ LOCATION = os.getenv("GCP_LOCATION", "us-central1")
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
+# Budget for one Gemini reply; past it the caller gets ACK_TEMPLATE
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Priority admission: these priorities get ACK_TEMPLATE instead of a model
+# reply once LLM_SHED_IN_FLIGHT calls are running or LLM_SHED_WAITING wait
+LLM_SHED_PRIORITIES = os.getenv("LLM_SHED_PRIORITIES", "P3,P4").split(",")
+LLM_SHED_IN_FLIGHT = int(os.getenv("LLM_SHED_IN_FLIGHT", "4"))
+LLM_SHED_WAITING = int(os.getenv("LLM_SHED_WAITING", "1"))
+
+ACK_TEMPLATE = (
+    "Your {priority} issue has been logged. "
+    "Our support team will respond within {response_mins} minutes."
+)
+
 ISSUES_COL = "issues"
 USERS_COL = "users"
 
@@ -52,6 +68,18 @@ SLA_POLICY: Dict[str, Dict[str, int]] = {
 db = firestore.Client(project=PROJECT_ID)
 publisher = pubsub_v1.PublisherClient()
 tasks_client = tasks_v2.CloudTasksClient()
+llm = LLMGateway(
+    project=PROJECT_ID,
+    location=LOCATION,
+    model=GEMINI_MODEL,
+    timeout_seconds=LLM_TIMEOUT_SECONDS,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    # Most urgent first, by SLA response time
+    priority_order=sorted(SLA_POLICY, key=lambda p: SLA_POLICY[p]["response_mins"]),
+    shed_priorities=LLM_SHED_PRIORITIES,
+    shed_in_flight=LLM_SHED_IN_FLIGHT,
+    shed_waiting=LLM_SHED_WAITING,
+)
 
 topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
 queue_path = tasks_client.queue_path(PROJECT_ID, LOCATION, TASK_QUEUE)
@@ -75,24 +103,17 @@ def json_response(payload: Dict[str, Any]):
 # =====================================================
 # Gemini (safe)
 # =====================================================
-def vertex_client() -> genai.Client:
-    return genai.Client(
-        vertexai=True,
-        project=PROJECT_ID,
-        location=LOCATION,
-    )
+def ack_reply(priority: str) -> str:
+    policy = SLA_POLICY.get(priority, SLA_POLICY["P3"])
+    return ACK_TEMPLATE.format(priority=priority, response_mins=policy["response_mins"])
 
 
-def gemini_reply(issue_text: str) -> str:
-    try:
-        client = vertex_client()
-        resp = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=f"Acknowledge the issue briefly:\n{issue_text}",
-        )
-        return (resp.text or "").strip() or "Your issue has been logged."
-    except Exception:
-        return "Your issue has been logged."
+def gemini_reply(issue_text: str, priority: str) -> str:
+    return llm.generate(
+        f"Acknowledge the issue briefly:\n{issue_text}",
+        fallback=ack_reply(priority),
+        priority=priority,
+    )
 
 
 # =====================================================
@@ -206,12 +227,20 @@ def schedule_status_flow(issue_id: str):
 # HTTP Entrypoints
 # =====================================================
 def submit_issue(request):
+    # LLM gateway load and per-priority outcomes (shed rate) for monitoring
+    if request.method == "GET":
+        return json_response({"llm_gateway": llm.stats()})
+
     try:
         body = request.get_json(silent=True) or {}
 
         reporter_id = (body.get("reporter_id") or "").strip()
         issue_text = (body.get("issue") or "").strip()
-        priority = (body.get("priority") or "P3").upper()
+        priority = str(body.get("priority") or "P3").strip().upper()
+
+        # Unknown levels get the default SLA, as in the other issue APIs
+        if priority not in SLA_POLICY:
+            priority = "P3"
 
         if not reporter_id or len(issue_text) < 5:
             return json_response({"status": "failed"})
@@ -234,7 +263,7 @@ def submit_issue(request):
         return json_response({
             "issue_id": issue_id,
             "status": "created",
-            "assistant_reply": gemini_reply(issue_text),
+            "assistant_reply": gemini_reply(issue_text, priority),
         })
 
     except Exception:
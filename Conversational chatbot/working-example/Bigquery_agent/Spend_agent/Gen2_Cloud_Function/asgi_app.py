@@ -0,0 +1,299 @@
+# asgi_app.py
+#
+# Async (ASGI) entry point for the Spend agent, for Cloud Run:
+#
+#     uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+#
+# Same requests and responses as main.entry_point. A question waiting on
+# BigQuery holds no thread: the job is submitted, then polled from the
+# event loop. Planning, cache lookups and result downloads run briefly on
+# the default thread pool. Trend questions (and dashboard batches) wait on
+# BigQuery from a pool thread, but only until the request deadline: the
+# thread is freed when the request times out.
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import main
+from main import LocalEngineUnavailable, QueryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+# Questions answered at once; up to ASYNC_MAX_WAITING more wait for a slot,
+# beyond that requests are rejected with 503
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("ASYNC_MAX_CONCURRENCY", "200"))
+ASYNC_MAX_WAITING = int(os.environ.get("ASYNC_MAX_WAITING", "400"))
+
+# Per-request deadline (waiting for a slot included); a request may ask for
+# less with "timeout_ms"
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "60"))
+
+# Threads for the short blocking steps (API calls, downloads, planning)
+ASYNC_IO_THREADS = int(os.environ.get("ASYNC_IO_THREADS", "32"))
+
+# BigQuery job polling: exponential backoff between status checks
+JOB_POLL_INITIAL_SECONDS = 0.05
+JOB_POLL_MAX_SECONDS = 1.0
+
+_slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+SERVER_STATS = {"in_flight": 0, "waiting": 0, "served": 0, "rejected": 0, "timed_out": 0}
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+]
+
+
+# ------------------------------
+# QUERY EXECUTION (ASYNC)
+# ------------------------------
+async def execute_query_async(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    job = await asyncio.to_thread(main.submit_query, sql, info, params)
+
+    # job.done() reloads the job state: one short API call per poll
+    delay = JOB_POLL_INITIAL_SECONDS
+    while not await asyncio.to_thread(job.done):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, JOB_POLL_MAX_SECONDS)
+
+    result = await asyncio.to_thread(main.job_result, job)
+    return await asyncio.to_thread(main.store_result, sql, version, info, params, job, result)
+
+
+async def fetch_result_async(
+    sql: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Async main.fetch_result: same cache tiers and single-flight (shared
+    with synchronous callers). The leader's work runs as its own task, so
+    a request hitting its deadline does not abort a job others wait on;
+    the result still lands in the cache.
+    """
+    if main.active_engine() != "bigquery":
+        return await asyncio.to_thread(main.fetch_result, sql, info, params)
+
+    info.update({"cache_hit": False, "estimated_bytes": None, "bytes_billed": 0})
+    version = main.data_version()
+    result = main.cached_result(sql, version, info, params)
+    if result is not None:
+        return result
+
+    key, future, leader = main.join_inflight(sql, version, params)
+    if not leader:
+        info["coalesced"] = True
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def lead():
+        try:
+            # Re-check: a previous leader may have stored it since the miss
+            result = main.cached_result(sql, version, info, params)
+            if result is None:
+                result = await asyncio.to_thread(main.fetch_shared, sql, version, info, params)
+            if result is None:
+                result = await execute_query_async(sql, version, info, params)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            main.leave_inflight(key)
+
+    task = asyncio.ensure_future(lead())
+    # Nobody may be left to await it after a timeout
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return await asyncio.shield(task)
+
+
+async def ask_agent_async(
+    question: str,
+    offset: int = 0,
+    page_size: Optional[int] = None,
+    stream: bool = False,
+) -> Dict[str, Any]:
+    plan = await asyncio.to_thread(main.plan_question, question)
+
+    if plan.intent.period:
+        engine, result = await asyncio.to_thread(main.answer_series, plan)
+    else:
+        engine, result = "cube", main.answer_from_cube(plan.intent)
+        if result is None:
+            try:
+                engine = main.active_engine()
+                result = await fetch_result_async(plan.sql, plan.cost, plan.params)
+            except QueryBudgetExceeded as e:
+                engine, result = main.answer_over_budget(plan, e)
+
+    return main.answer_response(plan, engine, result, offset, page_size, stream)
+
+
+# ------------------------------
+# REQUESTS
+# ------------------------------
+def request_timeout(payload: Dict[str, Any]) -> float:
+    timeout_ms = payload.get("timeout_ms")
+    if isinstance(timeout_ms, (int, float)) and timeout_ms > 0:
+        return min(timeout_ms / 1000, REQUEST_TIMEOUT_SECONDS)
+    return REQUEST_TIMEOUT_SECONDS
+
+
+async def answer_payload(payload: Dict[str, Any]) -> Tuple[int, Any]:
+    with main.use_engine(payload.get("engine")):
+        if payload.get("questions") is not None:
+            # Dashboard batches are rare; they keep the blocking path
+            batch = await asyncio.to_thread(main.ask_agent_batch, main.batch_questions(payload))
+            return 200, batch
+
+        question = payload["question"].strip()
+        if payload.get("format") == "ndjson":
+            return 200, await ask_agent_async(question, stream=True)
+
+        offset, page_size = main.page_args(payload)
+        return 200, await ask_agent_async(question, offset=offset, page_size=page_size)
+
+
+async def answer_limited(payload: Dict[str, Any]) -> Tuple[int, Any]:
+    SERVER_STATS["waiting"] += 1
+    try:
+        await _slots.acquire()
+    finally:
+        SERVER_STATS["waiting"] -= 1
+
+    SERVER_STATS["in_flight"] += 1
+    try:
+        return await answer_payload(payload)
+    finally:
+        SERVER_STATS["in_flight"] -= 1
+        _slots.release()
+
+
+async def handle_post(payload: Dict[str, Any]) -> Tuple[int, Any]:
+    error = main.request_error(payload)
+    if error:
+        return 400, {"error": error}
+
+    if SERVER_STATS["waiting"] >= ASYNC_MAX_WAITING:
+        SERVER_STATS["rejected"] += 1
+        return 503, {"error": "Too many requests in flight; retry shortly"}
+
+    timeout = request_timeout(payload)
+    try:
+        # Blocking waits in pool threads give up at the same deadline
+        with main.use_deadline(time.monotonic() + timeout):
+            status, body = await asyncio.wait_for(answer_limited(payload), timeout)
+    except asyncio.TimeoutError:
+        SERVER_STATS["timed_out"] += 1
+        return 504, {"error": "Request deadline exceeded"}
+    except QueryBudgetExceeded as e:
+        logger.warning("Rejected over-budget query: %s", e)
+        return 400, {"error": str(e), "estimated_bytes": e.estimated_bytes, "byte_budget": e.budget}
+    except LocalEngineUnavailable as e:
+        logger.warning("Local engine unavailable: %s", e)
+        return 400, {"error": "local engine unavailable"}
+
+    SERVER_STATS["served"] += 1
+    return status, body
+
+
+# ------------------------------
+# ASGI
+# ------------------------------
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status: int, body: Any):
+    data = b"" if status == 204 else json.dumps(body, default=str).encode()
+    headers = [(b"content-type", b"application/json"), *CORS_HEADERS]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": data})
+
+
+async def send_ndjson(send, response: Dict[str, Any]):
+    headers = [(b"content-type", b"application/x-ndjson"), *CORS_HEADERS]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    chunk: List[str] = []
+    for line in main.ndjson_lines(response):
+        chunk.append(line)
+        if len(chunk) >= main.NDJSON_BATCH_ROWS:
+            await send({"type": "http.response.body", "body": "".join(chunk).encode(), "more_body": True})
+            chunk = []
+    await send({"type": "http.response.body", "body": "".join(chunk).encode()})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="asgi-io")
+            )
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    if method == "OPTIONS":
+        await send_json(send, 204, None)
+        return
+
+    if method == "GET":
+        args = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        if args.get("report") == "server":
+            await send_json(send, 200, SERVER_STATS)
+            return
+        try:
+            status, body = await asyncio.to_thread(main.handle_get, args)
+        except Exception as e:
+            logger.exception("Execution error")
+            status, body = 500, {"error": str(e)}
+        await send_json(send, status, body)
+        return
+
+    request_started = time.perf_counter()
+    try:
+        payload = json.loads(await read_body(receive) or b"{}")
+        if not isinstance(payload, dict):
+            payload = {}
+    except ValueError:
+        payload = {}
+
+    try:
+        status, body = await handle_post(payload)
+    except Exception as e:
+        logger.exception("Execution error")
+        status, body = 500, {"error": str(e)}
+
+    if status == 200 and "row_iter" in body:
+        await send_ndjson(send, body)
+    else:
+        await send_json(send, status, body)
+    main.report_first_request(request_started)
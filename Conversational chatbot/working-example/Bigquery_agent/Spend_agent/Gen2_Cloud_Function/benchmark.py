@@ -0,0 +1,423 @@
+# benchmark.py
+#
+# Offline benchmark of the ask_agent hot path: a fake in-memory BigQuery
+# client, a seeded synthetic question corpus, and per-stage latency
+# (p50/p95/p99) and allocation figures for cache-miss and cache-hit runs.
+#
+#     python benchmark.py --output benchmark_baseline.json
+#     python benchmark.py --compare benchmark_baseline.json
+#
+# The baseline is plain sorted JSON so it can be diffed in review. Compare
+# runs from the same machine only. --compare exits 1 when any stage's p95
+# latency or p95 allocation exceeds the baseline by more than --tolerance
+# (default 25%) and by more than the absolute floors below, which keep
+# sub-millisecond stages from failing on timer noise.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+FAKE_SCHEMA = {
+    "business_unit": "STRING",
+    "business_segment": "STRING",
+    "category": "STRING",
+    "buyer": "STRING",
+    "supplier": "STRING",
+    "buying_channel": "STRING",
+    "amt_local": "FLOAT64",
+    "quantity": "INT64",
+    "savings_amt": "STRING",
+    "po_dt": "STRING",
+}
+FAKE_LATEST_PO = date(2025, 12, 31)
+
+METRIC_PHRASES = ["spend", "total spend", "savings", "volume", "count of POs", "how many orders"]
+WINDOW_PHRASES = ["", " last 12 months", " last year"]
+RANK_PHRASES = ["top 5", "top ten", "bottom 3", "largest", "top 20"]
+TREND_TEMPLATES = ["monthly {metric} by {dimension}", "{metric} trend", "{metric} by month"]
+
+SCENARIOS = ("miss", "hit")
+
+# Tracked metric -> absolute increase that must also be exceeded to fail
+TRACKED_METRICS = {"p95_ms": 0.05, "alloc_kib_p95": 4.0}
+
+
+# ------------------------------
+# FAKE BIGQUERY
+# ------------------------------
+class FakeField:
+    def __init__(self, name: str, field_type: str):
+        self.name = name
+        self.field_type = field_type
+
+
+class FakeTable:
+    def __init__(self, num_rows: int):
+        self.schema = [FakeField(name, kind) for name, kind in FAKE_SCHEMA.items()]
+        self.modified = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.num_rows = num_rows
+
+
+class FakeJob:
+    def __init__(self, rows: List[Dict[str, Any]], latency_s: float):
+        self._rows = rows
+        self._latency_s = latency_s
+        self.total_bytes_processed = 64 * 1024 * 1024
+        self.total_bytes_billed = self.total_bytes_processed
+        self.slot_millis = 10
+        self.cache_hit = False
+        self.job_id = "fake"
+
+    def done(self) -> bool:
+        return True
+
+    def result(self, **kwargs):
+        time.sleep(self._latency_s)
+        return [dict(row) for row in self._rows]
+
+    def to_arrow(self, **kwargs):
+        import pyarrow as pa
+
+        time.sleep(self._latency_s)
+        return pa.Table.from_pylist(self._rows)
+
+
+class FakeClient:
+    """
+    Answers any generated SQL with deterministic synthetic rows shaped
+    like its SELECT list: `rows` rows for grouped queries, one otherwise.
+    """
+
+    def __init__(self, rows: int, latency_ms: float):
+        self.rows = rows
+        self.latency_s = latency_ms / 1000
+        self.queries = 0
+        self._shapes: Dict[str, List[Dict[str, Any]]] = {}
+
+    def get_table(self, table_id: str) -> FakeTable:
+        return FakeTable(num_rows=1_000_000)
+
+    def query(self, sql: str, job_config=None, **kwargs) -> FakeJob:
+        if not getattr(job_config, "dry_run", False):
+            self.queries += 1
+        return FakeJob(self._rows_for(sql), self.latency_s)
+
+    def _rows_for(self, sql: str) -> List[Dict[str, Any]]:
+        rows = self._shapes.get(sql)
+        if rows is None:
+            rows = self._shapes[sql] = self._synthesize(sql)
+        return rows
+
+    def _synthesize(self, sql: str) -> List[Dict[str, Any]]:
+        import sqlglot
+        from sqlglot import exp
+
+        tree = sqlglot.parse_one(sql, read="bigquery")
+        names = [s.alias_or_name.lower() for s in tree.selects]
+        count = self.rows if tree.args.get("group") or "UNNEST" in sql.upper() else 1
+        limit = tree.args.get("limit")
+        if isinstance(limit, exp.Limit):
+            count = min(count, int(limit.expression.name))
+
+        return [{name: self._value(name, i) for name in names} for i in range(count)]
+
+    def _value(self, name: str, i: int) -> Any:
+        if name == "period":
+            index = FAKE_LATEST_PO.year * 12 + FAKE_LATEST_PO.month - 1 - (i % 24)
+            return date(index // 12, index % 12 + 1, 1)
+        if name == "max_po_dt":
+            return FAKE_LATEST_PO
+        if name in ("n", "count"):
+            return 1000 + i
+        if name in FAKE_SCHEMA:
+            return f"{name}_{i:05d}"
+        return round(1_000_000 / (i + 1), 2)
+
+
+def install_fake_bigquery(client: FakeClient):
+    module = types.ModuleType("google.cloud.bigquery")
+
+    class QueryJobConfig:
+        def __init__(self, **kwargs):
+            self.query_parameters = []
+            self.__dict__.update(kwargs)
+
+    class ScalarQueryParameter:
+        def __init__(self, name, kind, value):
+            self.name, self.kind, self.value = name, kind, value
+
+    module.Client = lambda project=None, **kwargs: client
+    module.QueryJobConfig = QueryJobConfig
+    module.ScalarQueryParameter = ScalarQueryParameter
+
+    try:
+        import google.cloud as cloud
+    except ImportError:
+        google = sys.modules.setdefault("google", types.ModuleType("google"))
+        cloud = types.ModuleType("google.cloud")
+        google.cloud = cloud
+        sys.modules["google.cloud"] = cloud
+    cloud.bigquery = module
+    sys.modules["google.cloud.bigquery"] = module
+
+
+# ------------------------------
+# CORPUS
+# ------------------------------
+def question_corpus(dimension_keywords: List[str], n: int, seed: int) -> List[str]:
+    """
+    Seeded mix: ~60% grouped (half of them ranked), ~20% totals, ~20% trends.
+    """
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n):
+        metric = rng.choice(METRIC_PHRASES)
+        dimension = rng.choice(dimension_keywords)
+        window = rng.choice(WINDOW_PHRASES)
+        shape = rng.random()
+        if shape < 0.3:
+            questions.append(f"{metric} by {dimension}{window}")
+        elif shape < 0.6:
+            plural = dimension[:-1] + "ies" if dimension.endswith("y") else dimension + "s"
+            questions.append(f"{rng.choice(RANK_PHRASES)} {plural} by {metric}{window}")
+        elif shape < 0.8:
+            questions.append(f"what is our {metric}{window}")
+        else:
+            template = rng.choice(TREND_TEMPLATES)
+            questions.append(template.format(metric=metric, dimension=dimension))
+    return questions
+
+
+# ------------------------------
+# STAGES
+# ------------------------------
+def reset_caches(main):
+    main.QUERY_RESULT_CACHE.clear()
+    main.PLAN_CACHE.clear()
+    main.DRY_RUN_CACHE.clear()
+    main.TIME_SERIES_CACHE.clear()
+
+
+def run_question(main, question: str, scenario: str, stage: Callable):
+    """
+    One question through each stage; stage(name, fn, *args) runs and
+    measures a step. For misses every cache is emptied first, and again
+    before the end-to-end ask_agent run.
+    """
+    if scenario == "miss":
+        reset_caches(main)
+
+    intent = stage("resolve_intent", main.resolve_intent, question)
+    filter_columns = [c for c, _ in intent.filters]
+    sql = stage(
+        "generate_sql", main.build_sql,
+        intent.metric, intent.dimensions, intent.time_window, filter_columns,
+    )
+    stage("validate_sql_ast", main.validate_sql_ast, sql)
+    plan_sql = stage("compile_intent", main.compile_intent, intent)
+    if intent.period:
+        stage("fetch_result", main.answer_time_series, intent)
+    else:
+        stage("fetch_result", main.fetch_result, plan_sql, None, main.intent_params(intent))
+
+    if scenario == "miss":
+        reset_caches(main)
+    response = stage("ask_agent", main.ask_agent, question)
+    stage("serialize", json.dumps, response, default=str)
+
+
+def untimed(name, fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def timed(samples: Dict[str, List[float]]) -> Callable:
+    def stage(name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        samples.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        return result
+    return stage
+
+
+def traced(samples: Dict[str, List[float]]) -> Callable:
+    def stage(name, fn, *args, **kwargs):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        samples.setdefault(name, []).append((peak - before) / 1024)
+        return result
+    return stage
+
+
+def summarize(latency: Dict[str, List[float]], alloc: Dict[str, List[float]]) -> Dict[str, Any]:
+    from telemetry import percentile
+
+    return {
+        name: {
+            "n": len(values),
+            "p50_ms": round(percentile(values, 0.50), 4),
+            "p95_ms": round(percentile(values, 0.95), 4),
+            "p99_ms": round(percentile(values, 0.99), 4),
+            "alloc_kib_p50": round(percentile(alloc.get(name, []), 0.50), 1),
+            "alloc_kib_p95": round(percentile(alloc.get(name, []), 0.95), 1),
+        }
+        for name, values in latency.items()
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    client = FakeClient(rows=args.rows, latency_ms=args.bq_latency_ms)
+    install_fake_bigquery(client)
+
+    snapshot = os.path.join(tempfile.mkdtemp(prefix="spend_bench_"), "schema.json")
+    with open(snapshot, "w") as f:
+        json.dump(FAKE_SCHEMA, f)
+
+    # Offline, deterministic configuration; set before main is imported
+    os.environ.update({
+        "SCHEMA_SNAPSHOT_PATH": snapshot,
+        "SCHEMA_STARTUP_MODE": "snapshot",
+        "QUERY_ENGINE": "bigquery",
+        "ENABLE_SPEND_CUBE": "false",
+        "ENABLE_VALUE_DICTIONARY": "false",
+        "ENABLE_TELEMETRY": "false",
+        "ENABLE_PREWARM": "false",
+        "SHARED_CACHE_URL": "",
+        "MV_REGISTRY_PATH": os.path.join(os.path.dirname(snapshot), "no_views.json"),
+    })
+
+    import logging
+    import main
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Gemini insights run off the request path and need network access
+    main.submit_insight = lambda question, sql: None
+
+    questions = question_corpus(list(main.DIMENSION_KEYWORDS), args.questions, args.seed)
+
+    # Warm-up: imports, schema refresh, watermark and month fingerprints
+    for question in questions:
+        main.ask_agent(question)
+
+    results: Dict[str, Any] = {}
+    for scenario in SCENARIOS:
+        latency: Dict[str, List[float]] = {}
+        alloc: Dict[str, List[float]] = {}
+
+        if scenario == "hit":
+            # Fill every cache (a miss pass leaves them almost empty)
+            for question in questions:
+                run_question(main, question, scenario, untimed)
+
+        for _ in range(args.repeat):
+            for question in questions:
+                run_question(main, question, scenario, timed(latency))
+
+        tracemalloc.start()
+        try:
+            for question in questions:
+                run_question(main, question, scenario, traced(alloc))
+        finally:
+            tracemalloc.stop()
+
+        results[scenario] = summarize(latency, alloc)
+
+    return {
+        "config": {
+            "questions": args.questions,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "rows": args.rows,
+            "bq_latency_ms": args.bq_latency_ms,
+            "arrow": main.arrow_enabled(),
+            "python": platform.python_version(),
+        },
+        "scenarios": results,
+    }
+
+
+# ------------------------------
+# REPORT
+# ------------------------------
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    header = f"{'scenario':<8} {'stage':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'KiB p50':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+
+    for scenario, stages in report["scenarios"].items():
+        for name, s in stages.items():
+            line = (
+                f"{scenario:<8} {name:<18} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f}"
+                f" {s['p99_ms']:>9.3f} {s['alloc_kib_p50']:>9.1f}"
+            )
+            base = (baseline or {}).get("scenarios", {}).get(scenario, {}).get(name)
+            if base and base["p95_ms"]:
+                line += f" {(s['p95_ms'] / base['p95_ms'] - 1) * 100:>+11.1f}%"
+            print(line)
+
+
+def regressions(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Tracked metrics that regressed past tolerance, one line each."""
+    failures = []
+    for scenario, stages in report["scenarios"].items():
+        for name, s in stages.items():
+            base = baseline.get("scenarios", {}).get(scenario, {}).get(name)
+            if not base:
+                continue
+            for metric, floor in TRACKED_METRICS.items():
+                limit = max(base[metric] * (1 + tolerance), base[metric] + floor)
+                if s[metric] > limit:
+                    failures.append(
+                        f"{scenario}/{name} {metric}: {s[metric]} > {round(limit, 4)}"
+                        f" (baseline {base[metric]})"
+                    )
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Spend agent hot-path benchmark")
+    parser.add_argument("--questions", type=int, default=200, help="synthetic corpus size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes per scenario")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rows", type=int, default=200, help="rows per grouped fake result")
+    parser.add_argument("--bq-latency-ms", type=float, default=0.0, help="simulated job latency")
+    parser.add_argument("--output", help="write the report (baseline) to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare p95 against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="allowed p95 regression over the baseline (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if baseline:
+        failures = regressions(report, baseline, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
@@ -0,0 +1,149 @@
+# intent_matcher.py
+import re
+from typing import Container, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+# Metric keyword -> metric key. Order = priority when several appear.
+METRIC_KEYWORDS: List[Tuple[str, str]] = [
+    ("count", "count"),
+    ("how many", "count"),
+    ("number of", "count"),
+    ("volume", "volume"),
+    ("quantity", "volume"),
+    ("savings", "savings"),
+    ("spend", "spend"),
+    ("spent", "spend"),
+]
+METRIC_PRIORITY = ["count", "volume", "savings", "spend"]
+
+TIME_KEYWORDS: Dict[str, str] = {
+    "last 12 months": "last_12_months",
+    "last twelve months": "last_12_months",
+    "past 12 months": "last_12_months",
+    "last year": "last_12_months",
+}
+
+# Time-series (trend) phrasing -> period grain
+PERIOD_KEYWORDS: Dict[str, str] = {
+    "by month": "month",
+    "per month": "month",
+    "each month": "month",
+    "monthly": "month",
+    "month over month": "month",
+    "trend": "month",
+    "trends": "month",
+    "over time": "month",
+}
+
+# Words saying an approximate ranking is good enough
+APPROX_KEYWORDS = ["approx", "approximate", "approximately", "roughly", "estimated", "ballpark"]
+
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "fifteen": 15, "twenty": 20, "fifty": 50, "hundred": 100,
+}
+
+RANK_WORDS = ["top", "bottom", "largest", "biggest", "highest", "smallest", "lowest", "least"]
+
+_RANK_RE = re.compile(
+    r"(?<!at\s)\b(?P<dir>" + "|".join(RANK_WORDS) + r")\b"
+    r"(?:\s+(?P<n>\d+|" + "|".join(_NUMBER_WORDS) + r")\b)?"
+)
+_BOTTOM_WORDS = {"bottom", "smallest", "lowest", "least"}
+
+
+class MatchResult(NamedTuple):
+    metrics: Tuple[str, ...]         # count | volume | savings | spend, by priority
+    dimensions: Tuple[str, ...]      # column names, in order of mention
+    time_window: Optional[str]
+    top_n: Optional[int]
+    order: Optional[str]             # "desc" (top) | "asc" (bottom)
+    has_by: bool                     # question asks for a breakdown
+    approximate: bool                # caller accepts an approximate ranking
+    period: Optional[str]            # "month" for trend questions
+
+
+def _plural(keyword: str) -> List[str]:
+    forms = [keyword]
+    if keyword.endswith("y") and not keyword.endswith("ey"):
+        forms.append(keyword[:-1] + "ies")
+    elif not keyword.endswith("s"):
+        forms.append(keyword + "s")
+    return forms
+
+
+class IntentMatcher:
+    """
+    Tokenizes a question once with a single compiled regex (longest
+    keyword first) and returns every intent signal in one pass.
+    """
+
+    def __init__(self, dimension_keywords: Dict[str, str]):
+        self._kinds: Dict[str, Tuple[str, str]] = {}
+
+        for keyword, metric in METRIC_KEYWORDS:
+            self._kinds.setdefault(keyword, ("metric", metric))
+        for keyword, window in TIME_KEYWORDS.items():
+            self._kinds[keyword] = ("time", window)
+        for keyword, column in dimension_keywords.items():
+            for form in _plural(keyword):
+                self._kinds[form] = ("dimension", column)
+        for keyword, period in PERIOD_KEYWORDS.items():
+            self._kinds[keyword] = ("period", period)
+        for keyword in APPROX_KEYWORDS:
+            self._kinds[keyword] = ("approx", keyword)
+        for keyword in ("by", "per", "breakdown", "split"):
+            self._kinds.setdefault(keyword, ("by", keyword))
+
+        alternation = "|".join(
+            re.escape(k) for k in sorted(self._kinds, key=len, reverse=True)
+        )
+        self._pattern = re.compile(rf"\b(?:{alternation})\b")
+
+    def vocabulary(self) -> FrozenSet[str]:
+        """
+        Every word of every keyword (plural forms included), plus rank and
+        number words: the words that carry intent rather than a value.
+        """
+        words = {word for keyword in self._kinds for word in keyword.split()}
+        return frozenset(words | set(RANK_WORDS) | set(_NUMBER_WORDS))
+
+    def match(self, question: str, known_columns: Optional[Container[str]] = None) -> MatchResult:
+        q = question.lower()
+
+        metrics = set()
+        dimensions: List[str] = []
+        time_window = None
+        has_by = False
+        approximate = False
+        period = None
+
+        for m in self._pattern.finditer(q):
+            kind, value = self._kinds[m.group(0)]
+            if kind == "metric":
+                metrics.add(value)
+            elif kind == "dimension":
+                if value not in dimensions and (known_columns is None or value in known_columns):
+                    dimensions.append(value)
+            elif kind == "time":
+                time_window = value
+            elif kind == "period":
+                period = value
+            elif kind == "approx":
+                approximate = True
+            else:
+                has_by = True
+
+        ranked = tuple(k for k in METRIC_PRIORITY if k in metrics)
+
+        top_n, order = None, None
+        rank = _RANK_RE.search(q)
+        if rank:
+            order = "asc" if rank.group("dir") in _BOTTOM_WORDS else "desc"
+            n = rank.group("n")
+            if n:
+                top_n = int(n) if n.isdigit() else _NUMBER_WORDS[n]
+
+        return MatchResult(
+            ranked, tuple(dimensions), time_window, top_n, order, has_by, approximate, period
+        )
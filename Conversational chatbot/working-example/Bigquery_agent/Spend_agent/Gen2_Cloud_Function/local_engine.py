@@ -0,0 +1,198 @@
+# local_engine.py
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Transpiled statements kept per engine (plans are few; this only bounds memory)
+MAX_TRANSPILED = 2048
+
+
+class LocalEngineUnavailable(RuntimeError):
+    """The Parquet extract is missing or cannot be loaded."""
+
+
+def bigquery_type(arrow_type) -> str:
+    """
+    BigQuery type name for a Parquet/Arrow column, so TABLE_SCHEMA (and the
+    casts SQL generation picks from it) match the source table.
+    """
+    import pyarrow as pa
+
+    if pa.types.is_integer(arrow_type):
+        return "INT64"
+    if pa.types.is_floating(arrow_type):
+        return "FLOAT64"
+    if pa.types.is_decimal(arrow_type):
+        return "NUMERIC"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOL"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP"
+    return "STRING"
+
+
+def to_duckdb(sql: str, table: str, dataset: str) -> str:
+    """
+    Transpiles generated BigQuery SQL to DuckDB. References to tables in
+    the source dataset are pointed at the local table (CTE names are left
+    alone); SAFE.PARSE_DATE becomes TRY_STRPTIME so
+    unparseable dates give NULL as they do on BigQuery, FARM_FINGERPRINT
+    becomes DuckDB's HASH (only compared with itself, never with BigQuery)
+    and DATE_TRUNC is cast back to DATE (DuckDB returns a TIMESTAMP).
+    """
+    import sqlglot
+    from sqlglot import exp
+
+    def rewrite(node):
+        if isinstance(node, exp.Table) and node.db == dataset:
+            local = exp.to_table(table)
+            local.set("alias", node.args.get("alias"))
+            return local
+        if isinstance(node, exp.SafeFunc) and isinstance(node.this, exp.StrToDate):
+            parsed = exp.Anonymous(
+                this="TRY_STRPTIME",
+                expressions=[node.this.this, node.this.args["format"]],
+            )
+            return exp.TryCast(this=parsed, to=exp.DataType.build("DATE"))
+        if isinstance(node, exp.FarmFingerprint):
+            return exp.Anonymous(this="HASH", expressions=node.expressions)
+        return node
+
+    def date_trunc_to_date(node):
+        # Separate pass: transform() does not descend into replaced nodes
+        if isinstance(node, exp.DateTrunc):
+            return exp.Cast(this=node.copy(), to=exp.DataType.build("DATE"))
+        return node
+
+    tree = sqlglot.parse_one(sql, read="bigquery")
+    return tree.transform(rewrite).transform(date_trunc_to_date).sql(dialect="duckdb")
+
+
+class LocalEngine:
+    """
+    Runs the agent's generated BigQuery SQL on DuckDB over a Parquet extract
+    of the table, loaded into memory. The extract is reloaded when the file
+    changes. One DuckDB cursor per thread.
+    """
+
+    def __init__(self, parquet_path: str, table: str, dataset: str):
+        self.parquet_path = parquet_path
+        self.table = table
+        self.dataset = dataset
+
+        self.version: str = ""
+        self._conn = None
+        self._mtime: Optional[float] = None
+        self._transpiled: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ------------------------------
+    # LOAD
+    # ------------------------------
+    def ensure(self):
+        """
+        Connects on first use and reloads the table if the Parquet file
+        was replaced (e.g. by a new export). Raises LocalEngineUnavailable
+        when no extract can be loaded.
+        """
+        try:
+            mtime = os.stat(self.parquet_path).st_mtime
+        except OSError as e:
+            raise LocalEngineUnavailable(f"No Parquet extract at {self.parquet_path}") from e
+        if self._conn is not None and mtime == self._mtime:
+            return
+
+        with self._lock:
+            if self._conn is not None and mtime == self._mtime:
+                return
+
+            import duckdb
+
+            if self._conn is None:
+                self._conn = duckdb.connect(":memory:")
+
+            path = self.parquet_path.replace("'", "''")
+            try:
+                self._conn.execute(
+                    f"CREATE OR REPLACE TABLE {self.table} AS SELECT * FROM read_parquet('{path}')"
+                )
+            except duckdb.Error as e:
+                raise LocalEngineUnavailable(f"Cannot load {self.parquet_path}: {e}") from e
+            num_rows = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+            modified = datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat()
+            self._mtime = mtime
+            self.version = f"local:{modified}:{num_rows}"
+            logger.info("Local engine loaded %s: %d rows", self.parquet_path, num_rows)
+
+    def schema(self) -> Dict[str, str]:
+        import pyarrow.parquet as pq
+
+        arrow_schema = pq.read_schema(self.parquet_path)
+        return {f.name.lower(): bigquery_type(f.type) for f in arrow_schema}
+
+    # ------------------------------
+    # QUERY
+    # ------------------------------
+    def transpile(self, sql: str) -> str:
+        duck_sql = self._transpiled.get(sql)
+        if duck_sql is None:
+            duck_sql = to_duckdb(sql, self.table, self.dataset)
+            if len(self._transpiled) >= MAX_TRANSPILED:
+                self._transpiled.clear()
+            self._transpiled[sql] = duck_sql
+        return duck_sql
+
+    def query(self, sql: str, params: Optional[List[Tuple[str, Any]]] = None):
+        """
+        Executes BigQuery SQL locally; returns a pyarrow.Table.
+        @name parameters are bound by name.
+        """
+        self.ensure()
+
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._conn.cursor()
+            self._local.cursor = cursor
+
+        cursor.execute(self.transpile(sql), dict(params or []))
+        return cursor.fetch_arrow_table()
+
+
+# ------------------------------
+# EXPORT (BIGQUERY -> PARQUET)
+# ------------------------------
+def export_table(table_id: str, path: str, project: Optional[str] = None) -> int:
+    """
+    Snapshots a BigQuery table to Parquet through the Storage Read API.
+    The file is replaced atomically, so a running engine never reads a
+    partial export. Returns the number of rows written.
+    """
+    import pyarrow.parquet as pq
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=project)
+    table = client.list_rows(table_id).to_arrow(create_bqstorage_client=True)
+
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+    logger.info("Exported %s to %s: %d rows", table_id, path, table.num_rows)
+    return table.num_rows
+
+
+if __name__ == "__main__":
+    # python local_engine.py <project.dataset.table> <out.parquet>
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        sys.exit("usage: python local_engine.py <project.dataset.table> <out.parquet>")
+    export_table(sys.argv[1], sys.argv[2], project=sys.argv[1].split(".")[0])
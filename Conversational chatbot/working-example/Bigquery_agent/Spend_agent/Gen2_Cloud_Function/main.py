@@ -1,11 +1,54 @@
 # main.py
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import contextlib
+import contextvars
+import itertools
+import json
 import logging
 import threading
-from typing import Dict, Any, List, Optional
-
-import sqlglot
-from sqlglot import exp
+import uuid
+from datetime import date
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import (
+    TYPE_CHECKING, Callable, Dict, Any, Iterator, List, NamedTuple, Optional, Sequence, Tuple,
+)
+
+from intent_matcher import IntentMatcher, MatchResult
+from local_engine import LocalEngineUnavailable
+from mv_advisor import VIEW_DATE_COLUMN, VIEW_MEASURES, ViewRouter, ViewSpec
+from result_cache import ResultCache
+from time_series_cache import TimeSeriesCache, add_months
+
+
+class Intent(NamedTuple):
+    """
+    Canonical question intent. Paraphrases that resolve to the same intent
+    share one plan.
+    """
+    metric: str                             # SQL expression, e.g. "COUNT(*) AS count"
+    dimensions: Tuple[str, ...]             # GROUP BY columns, in order of mention
+    time_window: Optional[str]
+    filters: Tuple[Tuple[str, str], ...]    # ((column, value), ...)
+    top_n: Optional[int]
+    order: Optional[str]                    # "desc" | "asc"
+    breakdown: bool                         # question asks for a "by"/"per" split
+    approximate: bool                       # top-N served by APPROX_TOP_SUM/COUNT
+    period: Optional[str]                   # "month" for trend questions
+
+
+# sqlglot, numpy (spend_cube) and google-cloud-bigquery are imported lazily
+# so they stay off the cold-start path.
+if TYPE_CHECKING:
+    from local_engine import LocalEngine
+    from shared_cache import SharedCache
+    from spend_cube import SpendCube
+    from telemetry import TelemetryStore
+    from value_dictionary import ValueDictionary
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,17 +63,242 @@ TABLE = os.environ.get("BQ_TABLE", "sample_spenddata")
 FULL_TABLE_ID = f"{PROJECT_ID}.{DATASET}.{TABLE}"
 GEMINI_MODEL = os.environ.get("GENAI_MODEL", "gemini-2.5-pro")
 
+# Cold start: serve from a bundled schema snapshot, refresh in background
+SCHEMA_SNAPSHOT_PATH = os.environ.get(
+    "SCHEMA_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_snapshot.json"),
+)
+SCHEMA_STARTUP_MODE = os.environ.get("SCHEMA_STARTUP_MODE", "snapshot")  # snapshot | blocking
+
+# Result cache limits (per container)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "500"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "900"))
+
+# Shared second-tier result cache (across instances): redis://host:6379/0 in
+# production, sqlite:///path/file.sqlite for tests; empty disables it
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "")
+SHARED_CACHE_TTL_SECONDS = float(
+    os.environ.get("SHARED_CACHE_TTL_SECONDS", str(CACHE_TTL_SECONDS))
+)
+SHARED_CACHE_MAX_BYTES = int(os.environ.get("SHARED_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# How often (at most) we poll table metadata for new loads
+TABLE_VERSION_CHECK_SECONDS = float(os.environ.get("TABLE_VERSION_CHECK_SECONDS", "30"))
+
+# In-memory spend cube (answers simple metric x dimension questions locally)
+ENABLE_SPEND_CUBE = os.environ.get("ENABLE_SPEND_CUBE", "true").lower() == "true"
+CUBE_MAX_CELLS = int(os.environ.get("CUBE_MAX_CELLS", "2000000"))
+
+# A failed background build (cube, value dictionary) is retried for the same
+# table version after REFRESH_RETRY_SECONDS, doubling up to the max
+REFRESH_RETRY_SECONDS = float(os.environ.get("REFRESH_RETRY_SECONDS", "300"))
+REFRESH_RETRY_MAX_SECONDS = float(os.environ.get("REFRESH_RETRY_MAX_SECONDS", "3600"))
+
+# Result paging / Arrow fetch
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", "1000"))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "10000"))
+USE_ARROW = os.environ.get("USE_ARROW", "true").lower() == "true"
+NDJSON_BATCH_ROWS = 1000
+
+# Top-N / row caps. Grouped queries never return more than MAX_RESULT_ROWS;
+# APPROX_TOP_SUM serves top-N when the question (or ENABLE_APPROX_TOP) allows it.
+DEFAULT_TOP_N = int(os.environ.get("DEFAULT_TOP_N", "10"))
+MAX_RESULT_ROWS = int(os.environ.get("MAX_RESULT_ROWS", "10000"))
+ENABLE_APPROX_TOP = os.environ.get("ENABLE_APPROX_TOP", "false").lower() == "true"
+
+# Dimension value dictionary (fuzzy "supplier Acme" style filters)
+ENABLE_VALUE_DICTIONARY = os.environ.get("ENABLE_VALUE_DICTIONARY", "true").lower() == "true"
+DICT_MAX_VALUES = int(os.environ.get("DICT_MAX_VALUES", "100000"))
+DICT_MIN_SCORE = float(os.environ.get("DICT_MIN_SCORE", "0.6"))
+
+# Cost guard: dry-run estimate before executing, reject above the budget
+QUERY_BYTE_BUDGET = int(os.environ.get("QUERY_BYTE_BUDGET", str(10 * 1024 ** 3)))
+ENABLE_DRY_RUN = os.environ.get("ENABLE_DRY_RUN", "true").lower() == "true"
+
+# Gemini insights (background, bounded)
+INSIGHT_WORKERS = int(os.environ.get("INSIGHT_WORKERS", "4"))
+INSIGHT_QUEUE_LIMIT = int(os.environ.get("INSIGHT_QUEUE_LIMIT", "32"))
+INSIGHT_TTL_SECONDS = float(os.environ.get("INSIGHT_TTL_SECONDS", "600"))
+
+# Query engine: "bigquery", or "local" (DuckDB over a Parquet extract of the
+# table, for development and the air-gapped replica). Requests may override.
+QUERY_ENGINE = os.environ.get("QUERY_ENGINE", "bigquery").lower()
+QUERY_ENGINES = ("bigquery", "local")
+LOCAL_PARQUET_PATH = os.environ.get(
+    "LOCAL_PARQUET_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{TABLE}.parquet"),
+)
+
+# Trend questions: per-month buckets; only the latest TS_OPEN_MONTHS and
+# months whose content changed are re-queried after a table update
+TS_OPEN_MONTHS = int(os.environ.get("TS_OPEN_MONTHS", "2"))
+TS_MAX_SERIES = int(os.environ.get("TS_MAX_SERIES", "200"))
+
+# Query telemetry: sampled, written asynchronously to a local SQLite file
+ENABLE_TELEMETRY = os.environ.get("ENABLE_TELEMETRY", "true").lower() == "true"
+TELEMETRY_DB_PATH = os.environ.get("TELEMETRY_DB_PATH", "/tmp/spend_telemetry.sqlite")
+TELEMETRY_SAMPLE_RATE = float(os.environ.get("TELEMETRY_SAMPLE_RATE", "1.0"))
+# Longest a pre-warm list request waits for queued events to be written
+TELEMETRY_FLUSH_SECONDS = float(os.environ.get("TELEMETRY_FLUSH_SECONDS", "2.0"))
+
+# Materialized views: deployed views are listed in the registry file;
+# matching plans read the view instead of FULL_TABLE_ID. The advisor
+# suggests views for dimension sets above these thresholds.
+MV_REGISTRY_PATH = os.environ.get(
+    "MV_REGISTRY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "materialized_views.json"),
+)
+MV_MIN_CALLS = int(os.environ.get("MV_MIN_CALLS", "5"))
+MV_MIN_BYTES = int(os.environ.get("MV_MIN_BYTES", str(1024 ** 3)))
+MV_REFRESH_MINUTES = int(os.environ.get("MV_REFRESH_MINUTES", "60"))
+
+# Cache pre-warm: after startup, run the top plans from the persisted list
+# (telemetry.py --write-prewarm) in the background, within a time and an
+# estimated-bytes budget
+ENABLE_PREWARM = os.environ.get("ENABLE_PREWARM", "true").lower() == "true"
+PREWARM_PLANS_PATH = os.environ.get(
+    "PREWARM_PLANS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "prewarm_plans.json"),
+)
+PREWARM_TOP_K = int(os.environ.get("PREWARM_TOP_K", "20"))
+PREWARM_WORKERS = int(os.environ.get("PREWARM_WORKERS", "4"))
+PREWARM_SECONDS = float(os.environ.get("PREWARM_SECONDS", "60"))
+PREWARM_MAX_BYTES = int(os.environ.get("PREWARM_MAX_BYTES", str(5 * 1024 ** 3)))
+
+# Batch mode (dashboard tiles)
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "50"))
+
 # ------------------------------
 # GLOBAL CLIENTS & CACHES
 # ------------------------------
 bq_client = None
 gemini_model = None
 
-# Schema cache (once per container)
+# Schema cache (once per container). Replaced as a whole, never mutated,
+# so concurrent readers see either the old or the new schema.
 TABLE_SCHEMA: Dict[str, str] = {}
 
-# Aggressive in-memory query cache
-QUERY_RESULT_CACHE: Dict[str, List[Dict[str, Any]]] = {}
+# Bounded in-memory query cache (LRU + TTL + byte budget)
+QUERY_RESULT_CACHE = ResultCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    max_bytes=CACHE_MAX_BYTES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+)
+
+# Shared tier behind QUERY_RESULT_CACHE (connected on first use)
+SHARED_CACHE: Optional["SharedCache"] = None
+_shared_cache_lock = threading.Lock()
+_shared_cache_failed = False
+
+# Compiled question plans: canonical intent -> validated SQL
+PLAN_CACHE = ResultCache(
+    max_entries=int(os.environ.get("PLAN_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=4 * 1024 * 1024,
+    ttl_seconds=float(os.environ.get("PLAN_CACHE_TTL_SECONDS", "86400")),
+)
+
+# Table version = last modified time + row count of FULL_TABLE_ID.
+# Cached results are tagged with the version they were computed from.
+TABLE_VERSION: str = ""
+_table_version_checked_at = 0.0
+_table_version_lock = threading.Lock()
+
+# MAX(PO date) per table version, inlined into time filters as a literal
+_po_watermark: Dict[str, Optional[date]] = {}
+_po_watermark_lock = threading.Lock()
+
+# Local DuckDB engine (created on first local request) and the engine
+# selected for the current request
+LOCAL_ENGINE: Optional["LocalEngine"] = None
+_local_engine_lock = threading.Lock()
+_request_engine: contextvars.ContextVar = contextvars.ContextVar(
+    "request_engine", default=QUERY_ENGINE
+)
+
+# time.monotonic() deadline of the current request, if it has one (ASGI);
+# blocking waits on BigQuery give up when it passes
+_request_deadline: contextvars.ContextVar = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+# Content fingerprint per PO month, per table version (tells which trend
+# buckets and cube months changed)
+_month_fingerprint: Dict[str, Dict[date, Tuple[Any, ...]]] = {}
+_month_fingerprint_lock = threading.Lock()
+
+# Trend buckets survive table version changes; stale months are re-queried
+TIME_SERIES_CACHE = TimeSeriesCache(open_months=TS_OPEN_MONTHS, max_series=TS_MAX_SERIES)
+
+# Dry-run byte estimates per SQL signature (tagged with table version)
+DRY_RUN_CACHE = ResultCache(
+    max_entries=2000,
+    max_bytes=1024 * 1024,
+    ttl_seconds=float(os.environ.get("DRY_RUN_TTL_SECONDS", "86400")),
+)
+
+# Single-flight: one in-flight BigQuery job per canonical SQL
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+SINGLE_FLIGHT_STATS = {"leaders": 0, "followers": 0}
+
+# Gemini insight workers: at most INSIGHT_QUEUE_LIMIT running + queued
+INSIGHT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=INSIGHT_WORKERS, thread_name_prefix="insight"
+)
+_insight_slots = threading.BoundedSemaphore(INSIGHT_QUEUE_LIMIT)
+INSIGHT_CACHE = ResultCache(
+    max_entries=5000,
+    max_bytes=16 * 1024 * 1024,
+    ttl_seconds=INSIGHT_TTL_SECONDS,
+)
+# requested = submitted + dropped (queue full) + rejected (submit failed);
+# submitted = ready + failed + unavailable (no model) + still running
+INSIGHT_STATS = {
+    "requested": 0,
+    "submitted": 0,
+    "dropped": 0,
+    "rejected": 0,
+    "ready": 0,
+    "failed": 0,
+    "unavailable": 0,
+}
+_insight_stats_lock = threading.Lock()
+
+# Deployed materialized views (small JSON file, read once per instance)
+VIEW_ROUTER = ViewRouter.load(MV_REGISTRY_PATH)
+
+# Query telemetry store (created on first use)
+TELEMETRY: Optional["TelemetryStore"] = None
+_telemetry_lock = threading.Lock()
+
+# Spend cube (built in the background, refreshed per table version)
+SPEND_CUBE: Optional["SpendCube"] = None
+_cube_lock = threading.Lock()
+_table_num_rows = 0
+
+# Failed background builds: name -> {version, at, attempts, disabled}
+_refresh_failures: Dict[str, Dict[str, Any]] = {}
+
+# Value dictionary (loaded in the background, refreshed per table version)
+VALUE_DICTIONARY: Optional["ValueDictionary"] = None
+_dict_lock = threading.Lock()
+
+# Outcome counts of the startup pre-warm run
+PREWARM_STATS: Dict[str, Any] = {}
+_prewarm_lock = threading.Lock()
+
+# Cold-start timings (reported once, on the first request)
+STARTUP_TIMINGS: Dict[str, Any] = {
+    "revision": os.environ.get("K_REVISION", ""),
+}
+_first_request_seen = False
+
+# Callbacks run with the current version after every table version check
+# (at most once per TABLE_VERSION_CHECK_SECONDS): background builds of
+# derived data start here, and failed builds are retried here once their
+# backoff has passed. They must be cheap and idempotent.
+TABLE_VERSION_LISTENERS: List[Callable[[str], None]] = []
 
 # ------------------------------
 # DIMENSION REGISTRY (SAFE LIST)
@@ -45,6 +313,24 @@ DIMENSION_KEYWORDS = {
     "buying channel": "buying_channel",
 }
 
+# One compiled pass over the question for metric, dimensions, time window and rank
+INTENT_MATCHER = IntentMatcher(DIMENSION_KEYWORDS)
+
+# Question words outside the intent vocabulary that are never values
+QUESTION_FILLER_WORDS = {
+    "what", "which", "who", "how", "much", "is", "are", "was", "were", "did", "do",
+    "does", "the", "a", "an", "and", "or", "of", "for", "from", "in", "on", "to",
+    "with", "at", "our", "we", "us", "me", "show", "list", "give", "get", "total",
+    "sum", "all", "amount", "order", "orders", "po", "pos", "purchase", "purchases",
+}
+
+# Words that name metrics/dimensions/time/rank and must not match as values;
+# derived from the matcher so the two never drift apart
+QUESTION_STOPWORDS = INTENT_MATCHER.vocabulary() | QUESTION_FILLER_WORDS
+
+# Metric key -> summed column (count is COUNT(*))
+METRIC_COLUMNS = {"volume": "quantity", "savings": "savings_amt", "spend": "amt_local"}
+
 # ------------------------------
 # CLIENTS
 # ------------------------------
@@ -54,6 +340,175 @@ def ensure_clients():
         from google.cloud import bigquery
         bq_client = bigquery.Client(project=PROJECT_ID)
 
+    maybe_refresh_table_version()
+
+
+# ------------------------------
+# QUERY ENGINE (BIGQUERY / LOCAL)
+# ------------------------------
+@contextlib.contextmanager
+def use_engine(engine: Optional[str]):
+    engine = (engine or QUERY_ENGINE).lower()
+    if engine not in QUERY_ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    token = _request_engine.set(engine)
+    try:
+        yield
+    finally:
+        _request_engine.reset(token)
+
+
+def active_engine() -> str:
+    return _request_engine.get()
+
+
+@contextlib.contextmanager
+def use_deadline(deadline: Optional[float]):
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left before the request deadline (None: no deadline)."""
+    deadline = _request_deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def ensure_local_engine():
+    global LOCAL_ENGINE, TABLE_SCHEMA
+    if LOCAL_ENGINE is None:
+        with _local_engine_lock:
+            if LOCAL_ENGINE is None:
+                from local_engine import LocalEngine
+                LOCAL_ENGINE = LocalEngine(LOCAL_PARQUET_PATH, TABLE, DATASET)
+
+    LOCAL_ENGINE.ensure()
+    if not TABLE_SCHEMA:
+        TABLE_SCHEMA = LOCAL_ENGINE.schema()
+
+
+def ensure_engine():
+    if active_engine() == "local":
+        ensure_local_engine()
+    else:
+        ensure_clients()
+
+
+def data_version() -> str:
+    """
+    Version of the data behind the active engine; cached plans and results
+    are tagged with it.
+    """
+    if active_engine() == "local":
+        return LOCAL_ENGINE.version if LOCAL_ENGINE else ""
+    return TABLE_VERSION
+
+
+def forget_old_versions(store: Dict[str, Any]):
+    """
+    Drops per-version entries that belong to neither engine's current data.
+    """
+    current = {TABLE_VERSION, LOCAL_ENGINE.version if LOCAL_ENGINE else ""}
+    for version in [v for v in store if v not in current]:
+        del store[version]
+
+
+def query_rows(sql: str) -> List[Dict[str, Any]]:
+    """
+    Small uncached helper queries (watermark, month fingerprints) on the active engine.
+    """
+    if active_engine() == "local":
+        return LOCAL_ENGINE.query(sql).to_pylist()
+    job = bq_client.query(sql)
+    wait_for_job(job)
+    return [dict(row) for row in job.result()]
+
+
+# ------------------------------
+# TABLE VERSION (CACHE INVALIDATION)
+# ------------------------------
+def table_version_of(table) -> str:
+    global _table_num_rows
+    _table_num_rows = table.num_rows or 0
+    modified = table.modified.isoformat() if table.modified else ""
+    return f"{modified}:{table.num_rows}"
+
+
+def set_table_version(version: str):
+    global TABLE_VERSION
+    previous = TABLE_VERSION
+    TABLE_VERSION = version
+
+    if previous and version != previous:
+        PLAN_CACHE.invalidate_stale(version)
+        dropped = QUERY_RESULT_CACHE.invalidate_stale(version)
+        logger.info(
+            "Table changed (%s -> %s); invalidated %d cached results",
+            previous, version, dropped,
+        )
+
+    for listener in TABLE_VERSION_LISTENERS:
+        try:
+            listener(version)
+        except Exception:
+            logger.exception("Table version listener failed")
+
+
+def maybe_refresh_table_version(force: bool = False):
+    """
+    Cheap metadata-only check (no bytes scanned), at most once per
+    TABLE_VERSION_CHECK_SECONDS. Concurrent callers never wait on it.
+    """
+    global _table_version_checked_at
+
+    now = time.monotonic()
+    if not force and now - _table_version_checked_at < TABLE_VERSION_CHECK_SECONDS:
+        return
+
+    if not _table_version_lock.acquire(blocking=False):
+        return
+
+    try:
+        _table_version_checked_at = now
+        table = bq_client.get_table(FULL_TABLE_ID)
+        set_table_version(table_version_of(table))
+    except Exception:
+        logger.exception("Table version check failed; keeping cached results")
+    finally:
+        _table_version_lock.release()
+
+
+def refresh_backoff(name: str, version: str) -> bool:
+    """
+    True while a failed background build of this table version must not be
+    retried: always once disabled, else until its backoff delay has passed.
+    """
+    failure = _refresh_failures.get(name)
+    if failure is None or failure["version"] != version:
+        return False
+    if failure["disabled"]:
+        return True
+
+    delay = min(
+        REFRESH_RETRY_SECONDS * 2 ** (failure["attempts"] - 1), REFRESH_RETRY_MAX_SECONDS
+    )
+    return time.monotonic() - failure["at"] < delay
+
+
+def record_refresh_failure(name: str, version: str, disabled: bool = False):
+    failure = _refresh_failures.get(name)
+    attempts = failure["attempts"] + 1 if failure and failure["version"] == version else 1
+    _refresh_failures[name] = {
+        "version": version,
+        "at": time.monotonic(),
+        "attempts": attempts,
+        "disabled": disabled,
+    }
+
 
 def get_gemini():
     """
@@ -84,61 +539,121 @@ def load_schema_once():
     if TABLE_SCHEMA:
         return
 
-    ensure_clients()
-    table = bq_client.get_table(FULL_TABLE_ID)
+    refresh_schema()
+
+
+def refresh_schema():
+    """
+    Loads the live schema + table version from BigQuery (metadata only).
+    Holds the table version lock, so request-path checks skip their own
+    get_table meanwhile.
+    """
+    global TABLE_SCHEMA, _table_version_checked_at
 
-    for field in table.schema:
-        TABLE_SCHEMA[field.name.lower()] = field.field_type.upper()
+    started = time.perf_counter()
+    with _table_version_lock:
+        # Its version check is skipped: this thread holds the lock
+        ensure_clients()
+        table = bq_client.get_table(FULL_TABLE_ID)
 
+        TABLE_SCHEMA = {f.name.lower(): f.field_type.upper() for f in table.schema}
+        _table_version_checked_at = time.monotonic()
+        set_table_version(table_version_of(table))
+
+    STARTUP_TIMINGS["schema_refresh_ms"] = round((time.perf_counter() - started) * 1000, 1)
     logger.info("Schema cached with %d columns", len(TABLE_SCHEMA))
 
 
-# Load schema at container startup (warm instance = fast)
-load_schema_once()
+def load_schema_snapshot(path: str = SCHEMA_SNAPSHOT_PATH) -> bool:
+    """
+    Fills TABLE_SCHEMA from a bundled {column: type} JSON file.
+    Returns False if no usable snapshot exists.
+    """
+    global TABLE_SCHEMA
+
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if not snapshot:
+        return False
+
+    TABLE_SCHEMA = {k.lower(): v.upper() for k, v in snapshot.items()}
+    logger.info("Schema loaded from snapshot with %d columns", len(TABLE_SCHEMA))
+    return True
+
+
+def write_schema_snapshot(path: str = SCHEMA_SNAPSHOT_PATH):
+    """
+    Writes the live schema to path; run before deploying.
+    """
+    refresh_schema()
+    with open(path, "w") as f:
+        json.dump(TABLE_SCHEMA, f, indent=2, sort_keys=True)
+    logger.info("Schema snapshot written to %s", path)
 
 # ------------------------------
 # SAFE METRICS
 # ------------------------------
-def safe_sum(column: str) -> str:
+def numeric_expr(column: str) -> str:
     col_type = TABLE_SCHEMA.get(column.lower(), "")
     if col_type in {"INT64", "FLOAT64", "NUMERIC", "BIGNUMERIC"}:
-        return f"COALESCE(SUM({column}), 0)"
-    return f"COALESCE(SUM(SAFE_CAST({column} AS NUMERIC)), 0)"
+        return column
+    return f"SAFE_CAST({column} AS NUMERIC)"
 
 
-def resolve_metric(question: str) -> str:
-    q = question.lower()
+def safe_sum(column: str) -> str:
+    return f"COALESCE(SUM({numeric_expr(column)}), 0)"
 
-    if "count" in q or "how many" in q:
-        return "COUNT(*) AS count"
 
-    if "volume" in q and "quantity" in TABLE_SCHEMA:
-        return f"{safe_sum('quantity')} AS volume"
+def match_question(question: str) -> MatchResult:
+    return INTENT_MATCHER.match(question, known_columns=TABLE_SCHEMA)
 
-    if "savings" in q and "savings_amt" in TABLE_SCHEMA:
-        return f"{safe_sum('savings_amt')} AS savings"
+
+def metric_sql(metric_keys: Sequence[str]) -> str:
+    """
+    First requested metric the table can serve; spend by default.
+    """
+    for key in metric_keys:
+        if key == "count":
+            return "COUNT(*) AS count"
+        column = METRIC_COLUMNS[key]
+        if column in TABLE_SCHEMA:
+            return f"{safe_sum(column)} AS {key}"
 
     return f"{safe_sum('amt_local')} AS spend"
 
 
+def resolve_metric(question: str) -> str:
+    return metric_sql(match_question(question).metrics)
+
+
 # ------------------------------
 # DIMENSION DETECTION
 # ------------------------------
 def resolve_dimension(question: str) -> Optional[str]:
-    q = question.lower()
-    for keyword, column in DIMENSION_KEYWORDS.items():
-        if keyword in q and column in TABLE_SCHEMA:
-            return column
-    return None
+    dimensions = match_question(question).dimensions
+    return dimensions[0] if dimensions else None
 
 
 # ------------------------------
 # DATE FILTER (FAST + FAIL-OPEN)
 # ------------------------------
+def resolve_time_window(question: str) -> Optional[str]:
+    return match_question(question).time_window
+
+
 def build_time_filter(question: str) -> str:
-    q = question.lower()
+    return time_filter_sql(resolve_time_window(question))
+
 
-    po_expr = """
+def po_date_expr() -> str:
+    if TABLE_SCHEMA.get("po_dt") == "DATE":
+        return "PO_DT"
+
+    return """
     COALESCE(
         SAFE_CAST(PO_DT AS DATE),
         SAFE.PARSE_DATE('%Y-%m-%d', PO_DT),
@@ -147,17 +662,55 @@ def build_time_filter(question: str) -> str:
     )
     """
 
-    if "last 12 months" in q or "last year" in q:
-        return f"""
-        (
-          (SELECT COUNT(*) FROM `{FULL_TABLE_ID}` WHERE {po_expr} IS NOT NULL) = 0
-          OR
-          {po_expr} >= DATE_SUB(
-              (SELECT MAX({po_expr}) FROM `{FULL_TABLE_ID}`),
-              INTERVAL 12 MONTH
-          )
-        )
-        """
+
+def get_po_watermark() -> Optional[date]:
+    """
+    Latest PO date in the table, computed once per table version.
+    Returns None when no row has a parseable PO date.
+    """
+    version = data_version()
+    if version in _po_watermark:
+        return _po_watermark[version]
+
+    with _po_watermark_lock:
+        if version in _po_watermark:
+            return _po_watermark[version]
+
+        sql = f"SELECT MAX({po_date_expr()}) AS max_po_dt FROM `{FULL_TABLE_ID}`"
+        rows = query_rows(sql)
+        watermark = rows[0]["max_po_dt"] if rows else None
+
+        forget_old_versions(_po_watermark)
+        _po_watermark[version] = watermark
+        logger.info("PO date watermark for %s: %s", version, watermark)
+        return watermark
+
+
+def months_before(day: date, months: int) -> date:
+    """
+    Same semantics as BigQuery DATE_SUB(day, INTERVAL months MONTH).
+    """
+    index = day.year * 12 + (day.month - 1) - months
+    year, month = divmod(index, 12)
+    month += 1
+
+    for last_day in (31, 30, 29, 28):
+        try:
+            return date(year, month, min(day.day, last_day))
+        except ValueError:
+            continue
+    raise ValueError(f"Cannot shift {day} by {months} months")
+
+
+def time_filter_sql(time_window: Optional[str], po_expr: Optional[str] = None) -> str:
+    if time_window == "last_12_months":
+        watermark = get_po_watermark()
+        if watermark is None:
+            # No parseable dates: fail open (same as before)
+            return ""
+
+        start = months_before(watermark, 12)
+        return f"{po_expr or po_date_expr()} >= DATE '{start.isoformat()}'"
 
     return ""
 
@@ -166,23 +719,61 @@ def build_time_filter(question: str) -> str:
 # SQL GENERATION
 # ------------------------------
 def generate_sql(question: str) -> str:
-    metric = resolve_metric(question)
-    dimension = resolve_dimension(question)
-    time_filter = build_time_filter(question)
+    intent = resolve_intent(question)
+    return build_sql(
+        intent.metric, intent.dimensions, intent.time_window, [c for c, _ in intent.filters]
+    )
+
+
+def value_filter_sql(filter_columns: List[str]) -> str:
+    """
+    Parameterized equality filters; values are bound as @filter_<i>.
+    """
+    parts = []
+    for i, column in enumerate(filter_columns):
+        lhs = column if TABLE_SCHEMA.get(column) == "STRING" else f"CAST({column} AS STRING)"
+        parts.append(f"{lhs} = @filter_{i}")
+    return " AND ".join(parts)
+
+
+def where_sql(
+    time_window: Optional[str], filter_columns: List[str], po_expr: Optional[str] = None
+) -> str:
+    conditions = [
+        c for c in (time_filter_sql(time_window, po_expr), value_filter_sql(filter_columns)) if c
+    ]
+    return " AND ".join(f"({c.strip()})" for c in conditions)
+
+
+def build_sql(
+    metric: str,
+    dimensions: Sequence[str],
+    time_window: Optional[str],
+    filter_columns: Optional[List[str]] = None,
+    order: Optional[str] = None,
+    limit: Optional[int] = None,
+    table_id: str = FULL_TABLE_ID,
+    po_expr: Optional[str] = None,
+) -> str:
+    """
+    table_id / po_expr point the query at a materialized view instead of
+    the base table.
+    """
+    time_filter = where_sql(time_window, filter_columns or [], po_expr)
 
     select_parts = []
     group_by = ""
 
-    if dimension:
-        select_parts.append(dimension)
-        group_by = f"\nGROUP BY {dimension}"
+    if dimensions:
+        select_parts.extend(dimensions)
+        group_by = f"\nGROUP BY {', '.join(dimensions)}"
 
     select_parts.append(metric)
 
     sql = f"""
     SELECT
         {", ".join(select_parts)}
-    FROM `{FULL_TABLE_ID}`
+    FROM `{table_id}`
     """
 
     if time_filter:
@@ -190,145 +781,1798 @@ def generate_sql(question: str) -> str:
 
     if group_by:
         sql += group_by
+        # Always a total order: offset paging must see the same rows after a re-run
+        if order:
+            sql += f"\nORDER BY {metric_alias(metric)} {order.upper()}, {', '.join(dimensions)}"
+        else:
+            sql += f"\nORDER BY {', '.join(dimensions)}"
+        if limit:
+            sql += f"\nLIMIT {limit}"
+
+    return sql.strip()
+
+
+def build_approx_top_sql(
+    metric: str,
+    dimension: str,
+    time_window: Optional[str],
+    filter_columns: Optional[List[str]],
+    top_n: int,
+) -> str:
+    """
+    Approximate top-N by the metric: one APPROX_TOP_SUM (APPROX_TOP_COUNT for
+    counts) aggregate instead of grouping every value of the dimension.
+    """
+    alias = metric_alias(metric)
+    if alias == "count":
+        top, field = f"APPROX_TOP_COUNT({dimension}, {top_n})", "count"
+    else:
+        weight = numeric_expr(METRIC_COLUMNS[alias])
+        top, field = f"APPROX_TOP_SUM({dimension}, {weight}, {top_n})", "sum"
+
+    inner = f"SELECT {top} FROM `{FULL_TABLE_ID}`"
+    time_filter = where_sql(time_window, filter_columns or [])
+    if time_filter:
+        inner += f" WHERE {time_filter}"
+
+    sql = f"""
+    SELECT
+        item.value AS {dimension}, item.{field} AS {alias}
+    FROM UNNEST(({inner})) AS item
+    ORDER BY {alias} DESC
+    """
+    return sql.strip()
 
+
+def period_expr() -> str:
+    return f"DATE_TRUNC({po_date_expr().strip()}, MONTH)"
+
+
+def build_time_series_sql(
+    metric: str,
+    dimensions: Sequence[str],
+    filter_columns: Optional[List[str]],
+    start: Optional[date] = None,
+    months: Optional[List[date]] = None,
+    limit: Optional[int] = None,
+) -> str:
+    """
+    Metric per PO month (and dimensions). months restricts the scan to the
+    buckets being refreshed; rows without a parseable PO date are excluded.
+    """
+    period = period_expr()
+    conditions = [f"{period} IS NOT NULL"]
+    if months:
+        dates = ", ".join(f"DATE '{m.isoformat()}'" for m in months)
+        conditions.append(f"{period} IN ({dates})")
+    elif start:
+        conditions.append(f"{period} >= DATE '{start.isoformat()}'")
+    value_filter = value_filter_sql(filter_columns or [])
+    if value_filter:
+        conditions.append(value_filter)
+
+    groups = ", ".join(["period", *dimensions])
+    sql = f"""
+    SELECT
+        {", ".join([f"{period} AS period", *dimensions, metric])}
+    FROM `{FULL_TABLE_ID}`
+    WHERE {" AND ".join(f"({c})" for c in conditions)}
+    GROUP BY {groups}
+    ORDER BY {groups}
+    """
+    if limit:
+        sql += f"LIMIT {limit}"
     return sql.strip()
 
 
+def result_limit(intent: Intent) -> Optional[int]:
+    """
+    LIMIT for an intent: N for ranked questions, otherwise one row past the
+    hard cap so truncation can be detected.
+    """
+    if not intent.dimensions:
+        return None
+    if intent.order:
+        return intent.top_n
+    return MAX_RESULT_ROWS + 1
+
+
+def rank_rows(rows: List[Dict[str, Any]], intent: Intent) -> List[Dict[str, Any]]:
+    """
+    Applies the plan's ORDER BY / LIMIT to rows computed outside BigQuery
+    (cube answers, batch splits). Unranked rows follow build_sql's order:
+    by the dimensions, NULLs first.
+    """
+    if intent.dimensions:
+        rows = sorted(rows, key=lambda r: [(r[d] is not None, r[d]) for d in intent.dimensions])
+    if intent.order:
+        alias = metric_alias(intent.metric)
+        # Stable: ties keep the dimension order, as in build_sql
+        rows = sorted(rows, key=lambda r: r[alias] or 0, reverse=intent.order == "desc")
+    limit = result_limit(intent)
+    return rows[:limit] if limit else rows
+
+
+# ------------------------------
+# MATERIALIZED VIEWS
+# ------------------------------
+def view_table_id(name: str) -> str:
+    return f"{PROJECT_ID}.{DATASET}.{name}"
+
+
+def view_measure_exprs() -> Dict[str, str]:
+    """
+    Partial aggregates stored per view row; plans re-sum them.
+    """
+    measures = {"count": "COUNT(*)", "spend": f"SUM({numeric_expr('amt_local')})"}
+    if "quantity" in TABLE_SCHEMA:
+        measures["volume"] = f"SUM({numeric_expr('quantity')})"
+    if "savings_amt" in TABLE_SCHEMA:
+        measures["savings"] = f"SUM({numeric_expr('savings_amt')})"
+    return measures
+
+
+def view_metric(metric: str) -> str:
+    alias = metric_alias(metric)
+    return f"COALESCE(SUM({VIEW_MEASURES[alias]}), 0) AS {alias}"
+
+
+def route_view(intent: Intent) -> Optional[ViewSpec]:
+    """
+    Registered view able to answer the intent (BigQuery, non-trend plans).
+    """
+    if active_engine() != "bigquery" or intent.period or not len(VIEW_ROUTER):
+        return None
+    return VIEW_ROUTER.route(
+        metric_alias(intent.metric), intent.dimensions, [c for c, _ in intent.filters]
+    )
+
+
+def view_advice(since_hours: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Materialized views worth creating for dimension sets that are asked
+    often and scan a lot on this instance, with their DDL. Each view is
+    grouped by PO day, so it answers every metric and time window.
+    """
+    if not ENABLE_TELEMETRY:
+        return {"error": "Telemetry disabled"}
+
+    from mv_advisor import hot_dimension_sets, view_ddl, view_name
+    from telemetry import plan_stats
+
+    since = since_hours * 3600 if since_hours else None
+    measures = view_measure_exprs()
+
+    candidates = []
+    for hot in hot_dimension_sets(plan_stats(TELEMETRY_DB_PATH, since), MV_MIN_CALLS, MV_MIN_BYTES):
+        name = view_name(hot["dimensions"])
+        candidates.append({
+            **hot,
+            "name": name,
+            "measures": list(measures),
+            "registered": VIEW_ROUTER.get(name) is not None,
+            "ddl": view_ddl(
+                view_table_id(name), FULL_TABLE_ID, hot["dimensions"], po_date_expr(),
+                measures, refresh_minutes=MV_REFRESH_MINUTES,
+            ),
+        })
+
+    return {
+        "candidates": candidates,
+        "registered": [v._asdict() for v in VIEW_ROUTER.views.values()],
+        "registry_path": MV_REGISTRY_PATH,
+    }
+
+
 # ------------------------------
 # SQL VALIDATION (SECURITY)
 # ------------------------------
 def validate_sql_ast(sql: str):
+    import sqlglot
+    from sqlglot import exp
+
     tree = sqlglot.parse_one(sql, read="bigquery")
 
+    # Registered materialized views are allowed, with their own columns
+    view_columns = set()
     for table in tree.find_all(exp.Table):
-        if table.name.lower() != TABLE.lower():
+        view = VIEW_ROUTER.get(table.name)
+        if view is not None:
+            view_columns.update(c.lower() for c in view.columns)
+        elif table.name.lower() != TABLE.lower():
             raise ValueError(f"Unauthorized table used: {table.name}")
 
+    # ORDER BY may use output aliases; APPROX_TOP_* fields are read off the UNNEST alias
+    aliases = {a.alias.lower() for a in tree.find_all(exp.Alias)}
+    unnested = set()
+    for unnest in tree.find_all(exp.Unnest):
+        alias = unnest.args.get("alias")
+        if alias is not None:
+            unnested.update(c.name.lower() for c in alias.columns)
+            if alias.name:
+                unnested.add(alias.name.lower())
+
     for col in tree.find_all(exp.Column):
-        if col.name.lower() not in TABLE_SCHEMA:
+        if col.table and col.table.lower() in unnested:
+            continue
+        name = col.name.lower()
+        if name not in TABLE_SCHEMA and name not in aliases and name not in view_columns:
             raise ValueError(f"Unknown column detected: {col.name}")
 
 
 # ------------------------------
-# QUERY EXECUTION (CACHED)
+# QUESTION PLANS (CACHED)
 # ------------------------------
-def run_query_cached(sql: str) -> List[Dict[str, Any]]:
-    if sql in QUERY_RESULT_CACHE:
-        logger.info("Cache hit")
-        return QUERY_RESULT_CACHE[sql]
+def resolve_intent(question: str) -> Intent:
+    """
+    Canonical intent of a question, from a single matcher pass plus the
+    value dictionary lookup for filters.
+    """
+    match = match_question(question)
+    metric = metric_sql(match.metrics)
+
+    # Ranking only applies to grouped questions
+    top_n, order = None, None
+    if match.order and match.dimensions and not match.period:
+        order = match.order
+        top_n = min(match.top_n or DEFAULT_TOP_N, MAX_RESULT_ROWS)
+
+    approximate = (
+        (match.approximate or ENABLE_APPROX_TOP)
+        and order == "desc"
+        and len(match.dimensions) == 1
+    )
 
-    logger.info("Cache miss → executing BigQuery")
-    job = bq_client.query(sql)
-    rows = [dict(row) for row in job.result()]
-    QUERY_RESULT_CACHE[sql] = rows
-    return rows
+    return Intent(
+        metric=metric,
+        dimensions=match.dimensions,
+        time_window=match.time_window,
+        filters=resolve_filters(question, match.dimensions),
+        top_n=top_n,
+        order=order,
+        breakdown=match.has_by,
+        approximate=approximate,
+        period=match.period,
+    )
 
 
-# ------------------------------
-# CONFIDENCE SCORE
-# ------------------------------
-def confidence_score(sql: str) -> float:
-    score = 0.9
-    if "group by" in sql.lower():
-        score += 0.05
-    if "safe_cast" in sql.lower() or "safe.parse_date" in sql.lower():
-        score += 0.05
-    return round(min(score, 1.0), 2)
+def plan_key(intent: Intent) -> str:
+    dimensions = ",".join(intent.dimensions)
+    columns = ",".join(c for c, _ in intent.filters)
+    rank = f"{intent.order or ''}{intent.top_n or ''}{'~' if intent.approximate else ''}"
+    return (
+        f"{intent.metric}|{dimensions}|{intent.time_window or ''}|{columns}|{rank}"
+        f"|{intent.period or ''}"
+    )
 
 
-# ------------------------------
-# ASYNC GEMINI (NON-BLOCKING)
-# ------------------------------
-def run_gemini_async(question: str, sql: str):
+def intent_from_dict(data: Dict[str, Any]) -> Intent:
     """
-    Runs AFTER response is sent.
-    Used only for explanations & suggestions.
+    Inverse of Intent._asdict() after a JSON round trip (lists -> tuples).
     """
-    try:
-        model = get_gemini()
-        if not model:
-            return
-
-        prompt = f"""
-You are an analytics assistant.
+    return Intent(**{
+        **data,
+        "dimensions": tuple(data["dimensions"]),
+        "filters": tuple((column, value) for column, value in data["filters"]),
+    })
 
-User question:
-{question}
 
-Task:
-1. Explain the result in simple business language.
-2. Suggest 2 follow-up analytical questions.
+def intent_params(intent: Intent) -> List[Tuple[str, str]]:
+    return [(f"filter_{i}", value) for i, (_, value) in enumerate(intent.filters)]
 
-Rules:
-- Do NOT generate SQL
-- Do NOT mention tables or columns
-- Keep it short
-"""
 
-        response = model.generate_content(prompt)
-        insight = response.text.strip()
+def compile_plan(question: str) -> str:
+    """
+    Returns generated + AST-validated SQL for the question.
+    Validation (sqlglot parse) runs once per intent and table version.
+    """
+    return compile_intent(resolve_intent(question))
 
-        logger.info("Gemini async insight: %s", insight)
 
-    except Exception:
-        logger.exception("Gemini async task failed")
+def compile_intent(intent: Intent) -> str:
+    """
+    The plan depends on filter columns only; values are bound as parameters.
+    """
+    key = f"{active_engine()}|{plan_key(intent)}"
+    version = data_version()
+
+    sql = PLAN_CACHE.get(key, tag=version)
+    if sql is not None:
+        return sql
+
+    filter_columns = [c for c, _ in intent.filters]
+    view = route_view(intent)
+    if intent.period:
+        months = series_months(intent)
+        sql = build_time_series_sql(
+            intent.metric, intent.dimensions, filter_columns,
+            start=months[0] if months and intent.time_window else None,
+        )
+    elif view is not None:
+        # Exact and cheaper than APPROX_TOP_* over the base table
+        sql = build_sql(
+            view_metric(intent.metric), intent.dimensions, intent.time_window, filter_columns,
+            order=intent.order, limit=result_limit(intent),
+            table_id=view_table_id(view.name), po_expr=VIEW_DATE_COLUMN,
+        )
+    elif intent.approximate and active_engine() == "bigquery":
+        sql = build_approx_top_sql(
+            intent.metric, intent.dimensions[0], intent.time_window, filter_columns, intent.top_n
+        )
+    else:
+        sql = build_sql(
+            intent.metric, intent.dimensions, intent.time_window, filter_columns,
+            order=intent.order, limit=result_limit(intent),
+        )
+    validate_sql_ast(sql)
+    PLAN_CACHE.put(key, sql, tag=version)
+    return sql
 
 
 # ------------------------------
-# MAIN AGENT (FAST PATH)
+# QUERY EXECUTION (CACHED)
 # ------------------------------
-def ask_agent(question: str) -> Dict[str, Any]:
-    sql = generate_sql(question)
-    validate_sql_ast(sql)
-    rows = run_query_cached(sql)
+def arrow_enabled() -> bool:
+    if not USE_ARROW:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
 
-    #  Async Gemini (never blocks)
-    threading.Thread(
-        target=run_gemini_async,
-        args=(question, sql),
-        daemon=True
-    ).start()
 
-    warnings = []
-    if resolve_dimension(question) is None and "by" in question.lower():
-        warnings.append("Requested grouping not recognized; returning overall metric.")
+class QueryBudgetExceeded(ValueError):
+    def __init__(self, estimated_bytes: int, budget: int):
+        super().__init__(
+            f"Query would scan {estimated_bytes} bytes, over the {budget} byte budget"
+        )
+        self.estimated_bytes = estimated_bytes
+        self.budget = budget
 
-    return {
-        "question": question,
-        "sql": sql,
-        "rows": rows,
-        "confidence_score": confidence_score(sql),
-        "warnings": warnings,
-        "cache_size": len(QUERY_RESULT_CACHE),
-    }
 
+class DeadlineExceeded(TimeoutError):
+    """The request deadline passed while waiting on BigQuery."""
 
-# ------------------------------
-# HTTP ENTRY POINT
-# ------------------------------
-def entry_point(request):
-    from flask import jsonify, make_response
 
-    # CORS preflight
-    if request.method == "OPTIONS":
-        resp = make_response("", 204)
-        resp.headers["Access-Control-Allow-Origin"] = "*"
-        resp.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+def canonical_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def query_job_config(params: Optional[List[Tuple[str, str]]] = None, **kwargs):
+    from google.cloud import bigquery
+
+    config = bigquery.QueryJobConfig(**kwargs)
+    if params:
+        config.query_parameters = [
+            bigquery.ScalarQueryParameter(name, "STRING", value) for name, value in params
+        ]
+    return config
+
+
+def result_cache_key(sql: str, params: Optional[List[Tuple[str, str]]] = None) -> str:
+    key = sql + "|" + json.dumps(params) if params else sql
+    return f"local|{key}" if active_engine() == "local" else key
+
+
+def estimate_query_bytes(
+    sql: str, params: Optional[List[Tuple[str, str]]] = None
+) -> Optional[int]:
+    """
+    BigQuery dry run (free, no slots), cached per SQL signature and table
+    version. Returns None if dry runs are disabled or fail.
+    """
+    if not ENABLE_DRY_RUN:
+        return None
+
+    key = canonical_sql(sql)
+    version = TABLE_VERSION
+    estimate = DRY_RUN_CACHE.get(key, tag=version)
+    if estimate is not None:
+        return estimate
+
+    try:
+        config = query_job_config(params, dry_run=True, use_query_cache=False)
+        estimate = int(bq_client.query(sql, job_config=config).total_bytes_processed or 0)
+    except Exception:
+        logger.exception("Dry run failed; executing without estimate")
+        return None
+
+    DRY_RUN_CACHE.put(key, estimate, tag=version)
+    return estimate
+
+
+def fetch_result(
+    sql: str,
+    info: Optional[Dict[str, Any]] = None,
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Returns the (cached) result of sql: a pyarrow.Table when Arrow is
+    available, otherwise a list of row dicts.
+    Concurrent misses for the same SQL + params share a single BigQuery job.
+    If info is given it is filled with cache / cost details for this call.
+    """
+    if info is None:
+        info = {}
+    info.update({"cache_hit": False, "estimated_bytes": None, "bytes_billed": 0})
+
+    version = data_version()
+    result = cached_result(sql, version, info, params)
+    if result is not None:
+        return result
+
+    key, future, leader = join_inflight(sql, version, params)
+    if not leader:
+        logger.info("Joining in-flight query")
+        info["coalesced"] = True
+        try:
+            return future.result(timeout=deadline_remaining())
+        except FutureTimeout:
+            raise DeadlineExceeded("Request deadline passed waiting for an in-flight query")
+
+    try:
+        # A leader that finished between the cache check and join_inflight
+        # has already stored the result
+        result = cached_result(sql, version, info, params)
+        if result is None:
+            result = fetch_shared(sql, version, info, params)
+        if result is None:
+            result = execute_query(sql, version, info, params)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        leave_inflight(key)
+
+
+def cached_result(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    result = QUERY_RESULT_CACHE.get(result_cache_key(sql, params), tag=version)
+    if result is not None:
+        logger.info("Cache hit")
+        info["cache_hit"] = True
+        info["cache_tier"] = "process"
+        info["estimated_bytes"] = DRY_RUN_CACHE.get(canonical_sql(sql), tag=version)
+    return result
+
+
+def join_inflight(
+    sql: str, version: str, params: Optional[List[Tuple[str, str]]] = None
+) -> Tuple[str, Future, bool]:
+    """
+    Single-flight registration. Returns (key, future, leader); the leader
+    runs the query and must call leave_inflight(key) when done.
+    """
+    key = f"{version}|{result_cache_key(canonical_sql(sql), params)}"
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+            SINGLE_FLIGHT_STATS["leaders"] += 1
+        else:
+            SINGLE_FLIGHT_STATS["followers"] += 1
+    return key, future, leader
+
+
+def leave_inflight(key: str):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def execute_query(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Runs sql on BigQuery and caches the result. Arrow results are fetched
+    through the BigQuery Storage Read API and cached columnar.
+    Raises QueryBudgetExceeded when the dry-run estimate is over budget;
+    maximum_bytes_billed enforces the same budget server-side.
+    """
+    if active_engine() == "local":
+        return execute_local(sql, version, info, params)
+
+    job = submit_query(sql, info, params)
+    wait_for_job(job)
+    return store_result(sql, version, info, params, job, job_result(job))
+
+
+def wait_for_job(job):
+    """
+    Waits at most until the request deadline (if any), so a request that
+    timed out does not keep its thread until BigQuery finishes. The job
+    is cancelled then: nobody will read its result.
+    """
+    remaining = deadline_remaining()
+    if remaining is None:
+        return
+    try:
+        job.result(timeout=remaining)
+    except FutureTimeout:
+        try:
+            job.cancel()
+        except Exception:
+            logger.exception("Job cancel failed")
+        raise DeadlineExceeded("Request deadline passed waiting for BigQuery")
+
+
+def submit_query(
+    sql: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Budget check, then starts the BigQuery job without waiting for it.
+    """
+    estimate = estimate_query_bytes(sql, params)
+    info["estimated_bytes"] = estimate
+    if estimate is not None and estimate > QUERY_BYTE_BUDGET:
+        raise QueryBudgetExceeded(estimate, QUERY_BYTE_BUDGET)
+
+    logger.info("Cache miss → executing BigQuery")
+    return bq_client.query(
+        sql, job_config=query_job_config(params, maximum_bytes_billed=QUERY_BYTE_BUDGET)
+    )
+
+
+def job_result(job):
+    """
+    Waits for the job (if still running) and downloads its result.
+    """
+    if arrow_enabled():
+        try:
+            return job.to_arrow(create_bqstorage_client=True)
+        except Exception:
+            logger.exception("Arrow fetch failed; falling back to row iteration")
+
+    return [dict(row) for row in job.result()]
+
+
+def store_result(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]],
+    job,
+    result,
+):
+    info["bytes_billed"] = int(job.total_bytes_billed or 0)
+    info["bytes_processed"] = int(job.total_bytes_processed or 0)
+    info["slot_ms"] = int(job.slot_millis or 0)
+
+    if not QUERY_RESULT_CACHE.put(result_cache_key(sql, params), result, tag=version):
+        logger.info("Result too large to cache")
+    store_shared(sql, version, result, params)
+    return result
+
+
+def execute_local(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Runs sql on the local DuckDB engine (no cost, no dry run) and caches it.
+    """
+    started = time.perf_counter()
+    result = LOCAL_ENGINE.query(sql, params)
+    info["local_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    if not QUERY_RESULT_CACHE.put(result_cache_key(sql, params), result, tag=version):
+        logger.info("Result too large to cache")
+    return result
+
+
+def get_shared_cache() -> Optional["SharedCache"]:
+    global SHARED_CACHE, _shared_cache_failed
+    if not SHARED_CACHE_URL or _shared_cache_failed:
+        return None
+
+    if SHARED_CACHE is None:
+        with _shared_cache_lock:
+            if SHARED_CACHE is None and not _shared_cache_failed:
+                from shared_cache import open_shared_cache
+                try:
+                    SHARED_CACHE = open_shared_cache(
+                        SHARED_CACHE_URL, max_payload_bytes=SHARED_CACHE_MAX_BYTES
+                    )
+                except Exception:
+                    logger.exception("Shared cache unavailable; using the in-process cache only")
+                    _shared_cache_failed = True
+    return SHARED_CACHE
+
+
+def shared_cache_key(sql: str, version: str, params: Optional[List[Tuple[str, str]]]) -> str:
+    from shared_cache import cache_key
+    return cache_key(version, result_cache_key(canonical_sql(sql), params))
+
+
+def fetch_shared(
+    sql: str,
+    version: str,
+    info: Dict[str, Any],
+    params: Optional[List[Tuple[str, str]]] = None,
+):
+    """
+    Second tier: a BigQuery result another instance already computed at
+    this table version. Hits are copied into the in-process cache.
+    """
+    cache = get_shared_cache()
+    if cache is None or active_engine() != "bigquery":
+        return None
+
+    result = cache.get(shared_cache_key(sql, version, params))
+    if result is None:
+        return None
+
+    logger.info("Shared cache hit")
+    info["cache_hit"] = True
+    info["cache_tier"] = "shared"
+    QUERY_RESULT_CACHE.put(result_cache_key(sql, params), result, tag=version)
+    return result
+
+
+def store_shared(
+    sql: str, version: str, result, params: Optional[List[Tuple[str, str]]] = None
+):
+    cache = get_shared_cache()
+    if cache is not None:
+        cache.put(shared_cache_key(sql, version, params), result, SHARED_CACHE_TTL_SECONDS)
+
+
+def single_flight_stats() -> Dict[str, Any]:
+    with _inflight_lock:
+        return {
+            "jobs_started": SINGLE_FLIGHT_STATS["leaders"],
+            "jobs_saved": SINGLE_FLIGHT_STATS["followers"],
+            "in_flight": len(_inflight),
+        }
+
+
+def result_num_rows(result) -> int:
+    return result.num_rows if hasattr(result, "num_rows") else len(result)
+
+
+def result_page(result, offset: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Materializes only rows [offset, offset + limit) as dicts.
+    """
+    if hasattr(result, "slice"):
+        return result.slice(offset, limit).to_pylist()
+    return result[offset:offset + limit]
+
+
+def iter_result_rows(result, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    if hasattr(result, "to_batches"):
+        rows = (
+            row
+            for batch in result.to_batches(max_chunksize=NDJSON_BATCH_ROWS)
+            for row in batch.to_pylist()
+        )
+    else:
+        rows = iter(result)
+    yield from itertools.islice(rows, limit)
+
+
+def run_query_cached(
+    sql: str,
+    params: Optional[List[Tuple[str, str]]] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    result = fetch_result(sql, info=info, params=params)
+    return result_page(result, 0, result_num_rows(result))
+
+
+# ------------------------------
+# SPEND CUBE (NO BIGQUERY)
+# ------------------------------
+def metric_alias(metric: str) -> str:
+    return metric.rsplit(" AS ", 1)[-1].strip()
+
+
+def cube_measures() -> Dict[str, str]:
+    measures = {"count": "COUNT(*)", "spend": safe_sum("amt_local")}
+    if "quantity" in TABLE_SCHEMA:
+        measures["volume"] = safe_sum("quantity")
+    if "savings_amt" in TABLE_SCHEMA:
+        measures["savings"] = safe_sum("savings_amt")
+    return measures
+
+
+def refresh_spend_cube():
+    global SPEND_CUBE
+    from spend_cube import CubeTooLarge, SpendCube
+
+    if not _cube_lock.acquire(blocking=False):
+        return
+
+    version = TABLE_VERSION
+    try:
+        ensure_clients()
+        with use_engine("bigquery"):
+            watermark = get_po_watermark()
+            fingerprint = get_month_fingerprint()
+        window_start = months_before(watermark, 12) if watermark else None
+
+        if SPEND_CUBE is None:
+            dimensions = sorted(
+                {c for c in DIMENSION_KEYWORDS.values() if c in TABLE_SCHEMA}
+            )
+            SPEND_CUBE = SpendCube(
+                table_id=FULL_TABLE_ID,
+                dimensions=dimensions,
+                measures=cube_measures(),
+                po_expr=po_date_expr(),
+                query_fn=lambda sql: [dict(r) for r in bq_client.query(sql).result()],
+                max_cells=CUBE_MAX_CELLS,
+            )
+
+        # Same cost guard as questions: the scan must fit the byte budget
+        estimate = estimate_query_bytes(SPEND_CUBE.build_sql(window_start))
+        if estimate is not None and estimate > QUERY_BYTE_BUDGET:
+            raise QueryBudgetExceeded(estimate, QUERY_BYTE_BUDGET)
+
+        SPEND_CUBE.refresh(version, window_start, _table_num_rows, fingerprint)
+        _refresh_failures.pop("cube", None)
+
+    except (CubeTooLarge, QueryBudgetExceeded) as e:
+        # Retrying cannot help until the table changes
+        logger.warning("Spend cube disabled for table version %s: %s", version, e)
+        record_refresh_failure("cube", version, disabled=True)
+    except Exception:
+        logger.exception("Spend cube refresh failed; BigQuery will answer")
+        record_refresh_failure("cube", version)
+    finally:
+        _cube_lock.release()
+
+
+def maybe_refresh_spend_cube():
+    """
+    Schedules a background (re)build when the cube lags the table version.
+    """
+    if not ENABLE_SPEND_CUBE or _cube_lock.locked():
+        return
+    if SPEND_CUBE is not None and SPEND_CUBE.version == TABLE_VERSION:
+        return
+    if refresh_backoff("cube", TABLE_VERSION):
+        return
+
+    threading.Thread(target=refresh_spend_cube, daemon=True).start()
+
+
+TABLE_VERSION_LISTENERS.append(lambda version: maybe_refresh_spend_cube())
+
+
+def answer_from_cube(
+    intent: Intent,
+    allow_stale: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+    cube = SPEND_CUBE
+    if cube is None:
+        return None
+
+    # The cube holds single-dimension slices and can only filter on that dimension
+    if intent.period or len(intent.dimensions) > 1:
+        return None
+    dimension = intent.dimensions[0] if intent.dimensions else None
+    filters = intent.filters
+    if filters and (len(filters) > 1 or filters[0][0] != dimension):
+        return None
+
+    measure = metric_alias(intent.metric)
+    version = cube.version if allow_stale else data_version()
+    if not version or not cube.can_answer(measure, dimension, version):
+        return None
+
+    rows = cube.answer(measure, dimension, windowed=intent.time_window is not None)
+    if filters:
+        value = filters[0][1]
+        rows = [r for r in rows if r[dimension] is not None and str(r[dimension]) == value]
+    return rank_rows(rows, intent)
+
+
+# ------------------------------
+# TIME SERIES (PER-MONTH BUCKETS)
+# ------------------------------
+def get_month_fingerprint() -> Dict[date, Tuple[Any, ...]]:
+    """
+    Content fingerprint per PO month, computed once per table version:
+    row count, the cube measure sums and an XOR of row hashes, so in-place
+    corrections are seen even when the count does not move. Months whose
+    fingerprint moved since a bucket was cached are re-queried.
+    """
+    version = data_version()
+    if version in _month_fingerprint:
+        return _month_fingerprint[version]
+
+    with _month_fingerprint_lock:
+        if version in _month_fingerprint:
+            return _month_fingerprint[version]
+
+        # Rounded: float sums may differ in the last bits between scans
+        measures = ", ".join(
+            f"{expr} AS {name}" if name == "count" else f"ROUND({expr}, 4) AS {name}"
+            for name, expr in cube_measures().items()
+        )
+        sql = f"""
+        SELECT
+            {period_expr()} AS period,
+            {measures},
+            BIT_XOR(FARM_FINGERPRINT(TO_JSON_STRING(t))) AS row_hash
+        FROM `{FULL_TABLE_ID}` AS t
+        GROUP BY period
+        """
+        fingerprint = {
+            row.pop("period"): tuple(row.values())
+            for row in query_rows(sql)
+            if row["period"] is not None
+        }
+
+        forget_old_versions(_month_fingerprint)
+        _month_fingerprint[version] = fingerprint
+        return fingerprint
+
+
+def forget_month_memos(version: str):
+    """
+    Drops watermarks and month fingerprints of table versions no longer
+    served, so trend buckets are checked against the new table version.
+    """
+    with _po_watermark_lock:
+        forget_old_versions(_po_watermark)
+    with _month_fingerprint_lock:
+        forget_old_versions(_month_fingerprint)
+
+
+TABLE_VERSION_LISTENERS.append(forget_month_memos)
+
+
+def series_months(intent: Intent) -> List[date]:
+    """
+    Months covered by a trend question. "Last 12 months" means the twelve
+    calendar months ending with the latest PO month.
+    """
+    fingerprint = get_month_fingerprint()
+    if not fingerprint:
+        return []
+
+    last = max(fingerprint)
+    first = add_months(last, -11) if intent.time_window else min(fingerprint)
+
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def series_key(intent: Intent) -> str:
+    filters = ",".join(f"{c}={v}" for c, v in intent.filters)
+    return f"{active_engine()}|{intent.metric}|{','.join(intent.dimensions)}|{filters}"
+
+
+def answer_time_series(
+    intent: Intent,
+    info: Optional[Dict[str, Any]] = None,
+    series_info: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Trend rows stitched from cached month buckets; only open or changed
+    months are queried.
+    """
+    months = series_months(intent)
+    if not months:
+        return []
+
+    filter_columns = [c for c, _ in intent.filters]
+    params = intent_params(intent)
+
+    def fetch(stale: List[date]) -> List[Dict[str, Any]]:
+        sql = build_time_series_sql(
+            intent.metric, intent.dimensions, filter_columns,
+            months=stale, limit=MAX_RESULT_ROWS + 1,
+        )
+        validate_sql_ast(sql)
+        result = fetch_result(sql, info=info, params=params)
+        return result_page(result, 0, result_num_rows(result))
+
+    rows = TIME_SERIES_CACHE.series(
+        series_key(intent), data_version(), months, get_month_fingerprint(), fetch,
+        info=series_info, max_rows=MAX_RESULT_ROWS,
+    )
+    return [{**row, "period": row["period"].isoformat()} for row in rows]
+
+
+# ------------------------------
+# VALUE DICTIONARY (FILTERS)
+# ------------------------------
+def refresh_value_dictionary():
+    global VALUE_DICTIONARY
+
+    if not _dict_lock.acquire(blocking=False):
+        return
+
+    version = TABLE_VERSION
+    try:
+        from value_dictionary import ValueDictionary
+
+        ensure_clients()
+
+        if VALUE_DICTIONARY is None:
+            columns = sorted({c for c in DIMENSION_KEYWORDS.values() if c in TABLE_SCHEMA})
+            VALUE_DICTIONARY = ValueDictionary(
+                table_id=FULL_TABLE_ID,
+                columns=columns,
+                query_fn=lambda sql: [dict(r) for r in bq_client.query(sql).result()],
+                max_values_per_column=DICT_MAX_VALUES,
+                min_score=DICT_MIN_SCORE,
+                stopwords=QUESTION_STOPWORDS,
+            )
+
+        VALUE_DICTIONARY.load(version)
+        _refresh_failures.pop("dictionary", None)
+
+    except Exception:
+        logger.exception("Value dictionary refresh failed; filters disabled")
+        record_refresh_failure("dictionary", version)
+    finally:
+        _dict_lock.release()
+
+
+def maybe_refresh_value_dictionary():
+    if not ENABLE_VALUE_DICTIONARY or _dict_lock.locked():
+        return
+    if VALUE_DICTIONARY is not None and VALUE_DICTIONARY.version == TABLE_VERSION:
+        return
+    if refresh_backoff("dictionary", TABLE_VERSION):
+        return
+
+    threading.Thread(target=refresh_value_dictionary, daemon=True).start()
+
+
+TABLE_VERSION_LISTENERS.append(lambda version: maybe_refresh_value_dictionary())
+
+
+def resolve_filters(
+    question: str, dimensions: Optional[Sequence[str]] = None
+) -> Tuple[Tuple[str, str], ...]:
+    """
+    Dimension value mentioned in the question (e.g. "supplier Acme"),
+    preferring the columns the question groups by. A slightly stale
+    dictionary is still used while the refresh runs.
+    """
+    dictionary = VALUE_DICTIONARY
+    if dictionary is None:
+        return ()
+
+    if dimensions is None:
+        dimensions = match_question(question).dimensions
+    match = None
+    if dimensions:
+        match = dictionary.match(question, columns=list(dimensions))
+    if match is None:
+        match = dictionary.match(question)
+    if match is None:
+        return ()
+
+    column, value, _ = match
+    return ((column, value),)
+
+
+# ------------------------------
+# CONFIDENCE SCORE
+# ------------------------------
+def confidence_score(sql: str, intent: Intent) -> float:
+    score = 0.9
+    if intent.dimensions or intent.period:
+        score += 0.05
+    elif intent.breakdown:
+        # Asked for a breakdown we could not map to a column
+        score -= 0.1
+    if "safe_cast" in sql.lower() or "safe.parse_date" in sql.lower():
+        score += 0.05
+    return round(min(score, 1.0), 2)
+
+
+# ------------------------------
+# ASYNC GEMINI (NON-BLOCKING)
+# ------------------------------
+def run_gemini_async(insight_id: str, question: str, sql: str):
+    """
+    Runs AFTER response is sent, on the bounded insight pool.
+    Used only for explanations & suggestions; the result is stored under
+    insight_id for get_insight().
+    """
+    try:
+        model = get_gemini()
+        if not model:
+            INSIGHT_CACHE.put(insight_id, {"status": "unavailable"})
+            count_insight("unavailable")
+            return
+
+        prompt = f"""
+You are an analytics assistant.
+
+User question:
+{question}
+
+Task:
+1. Explain the result in simple business language.
+2. Suggest 2 follow-up analytical questions.
+
+Rules:
+- Do NOT generate SQL
+- Do NOT mention tables or columns
+- Keep it short
+"""
+
+        response = model.generate_content(prompt)
+        insight = response.text.strip()
+
+        INSIGHT_CACHE.put(insight_id, {"status": "ready", "insight": insight})
+        count_insight("ready")
+        logger.info("Gemini async insight ready: %s", insight_id)
+
+    except Exception:
+        INSIGHT_CACHE.put(insight_id, {"status": "failed"})
+        count_insight("failed")
+        logger.exception("Gemini async task failed")
+
+    finally:
+        _insight_slots.release()
+
+
+def submit_insight(question: str, sql: str) -> Optional[str]:
+    """
+    Queues a Gemini insight. Returns its id, or None when the pool is
+    saturated (the insight is dropped rather than piling up threads).
+    """
+    count_insight("requested")
+    if not _insight_slots.acquire(blocking=False):
+        count_insight("dropped")
+        logger.warning("Insight queue full; dropping insight")
+        return None
+
+    insight_id = uuid.uuid4().hex
+    INSIGHT_CACHE.put(insight_id, {"status": "pending"})
+
+    try:
+        INSIGHT_EXECUTOR.submit(run_gemini_async, insight_id, question, sql)
+    except Exception:
+        _insight_slots.release()
+        INSIGHT_CACHE.invalidate(insight_id)
+        count_insight("rejected")
+        logger.exception("Insight submit failed")
+        return None
+
+    count_insight("submitted")
+    return insight_id
+
+
+def count_insight(outcome: str):
+    with _insight_stats_lock:
+        INSIGHT_STATS[outcome] += 1
+
+
+def insight_stats() -> Dict[str, Any]:
+    with _insight_stats_lock:
+        return dict(INSIGHT_STATS)
+
+
+def get_insight(insight_id: str) -> Dict[str, Any]:
+    entry = INSIGHT_CACHE.get(insight_id)
+    if entry is None:
+        return {"insight_id": insight_id, "status": "not_found"}
+    return {"insight_id": insight_id, **entry}
+
+
+# ------------------------------
+# MAIN AGENT (FAST PATH)
+# ------------------------------
+class QuestionPlan(NamedTuple):
+    """
+    A resolved question, ready to be answered (see ask_agent).
+    """
+    question: str
+    intent: Intent
+    sql: str
+    params: List[Tuple[str, str]]
+    view: Optional[ViewSpec]
+    warnings: List[str]
+    cost: Dict[str, Any]
+    series: Optional[Dict[str, Any]]        # filled for trend questions
+    started: float
+
+
+def plan_question(question: str) -> QuestionPlan:
+    started = time.perf_counter()
+    ensure_engine()
+
+    intent = resolve_intent(question)
+    return QuestionPlan(
+        question=question,
+        intent=intent,
+        sql=compile_intent(intent),
+        params=intent_params(intent),
+        view=route_view(intent),
+        warnings=question_warnings(intent),
+        cost={"byte_budget": QUERY_BYTE_BUDGET},
+        series={} if intent.period else None,
+        started=started,
+    )
+
+
+def answer_series(plan: QuestionPlan) -> Tuple[str, List[Dict[str, Any]]]:
+    result = answer_time_series(plan.intent, info=plan.cost, series_info=plan.series)
+    # No month had to be queried: the whole series came from cache
+    plan.cost.setdefault("cache_hit", True)
+    return active_engine(), result
+
+
+def answer_over_budget(plan: QuestionPlan, error: QueryBudgetExceeded) -> Tuple[str, Any]:
+    """
+    Cheaper path: the last cube build, even if a version behind.
+    """
+    result = answer_from_cube(plan.intent, allow_stale=True)
+    if result is None:
+        raise error
+    plan.warnings.append("Query exceeded the cost budget; answered from slightly older data.")
+    return "cube_stale", result
+
+
+def ask_agent(
+    question: str,
+    offset: int = 0,
+    page_size: Optional[int] = None,
+    stream: bool = False,
+) -> Dict[str, Any]:
+    """
+    Answers a question. Only one page of rows is materialized; with
+    stream=True the response carries a "row_iter" generator instead of rows.
+    Runs on the engine selected with use_engine() (BigQuery by default).
+    """
+    plan = plan_question(question)
+
+    if plan.intent.period:
+        engine, result = answer_series(plan)
+    else:
+        engine, result = "cube", answer_from_cube(plan.intent)
+        if result is None:
+            try:
+                engine = active_engine()
+                result = fetch_result(plan.sql, info=plan.cost, params=plan.params)
+            except QueryBudgetExceeded as e:
+                engine, result = answer_over_budget(plan, e)
+
+    return answer_response(plan, engine, result, offset, page_size, stream)
+
+
+def answer_response(
+    plan: QuestionPlan,
+    engine: str,
+    result,
+    offset: int = 0,
+    page_size: Optional[int] = None,
+    stream: bool = False,
+) -> Dict[str, Any]:
+    intent, sql, warnings, cost = plan.intent, plan.sql, plan.warnings, plan.cost
+
+    # Grouped plans fetch one row past the cap; its presence means truncation
+    total_rows = result_num_rows(result)
+    record_query(
+        plan.question, plan_key(intent), metric_alias(intent.metric),
+        ",".join(intent.dimensions), intent.time_window, engine, cost, plan.started,
+        total_rows, intent=intent,
+    )
+
+    truncated = total_rows > MAX_RESULT_ROWS
+    if truncated:
+        total_rows = MAX_RESULT_ROWS
+        warnings.append(
+            f"Result truncated to {MAX_RESULT_ROWS} rows; add a filter or ask for the top N."
+        )
+
+    offset = max(offset, 0)
+    limit = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    #  Async Gemini (never blocks; fetch later via insight_id)
+    insight_id = submit_insight(plan.question, sql)
+
+    view = plan.view
+    response = {
+        "question": plan.question,
+        "insight_id": insight_id,
+        "sql": sql,
+        "filters": [{"column": c, "value": v} for c, v in intent.filters],
+        "engine": engine,
+        "confidence_score": confidence_score(sql, intent),
+        "warnings": warnings,
+        "cost": cost,
+        "cache_size": QUERY_RESULT_CACHE.stats(),
+        "shared_cache": SHARED_CACHE.stats() if SHARED_CACHE is not None else None,
+        "single_flight": single_flight_stats(),
+        "insights": insight_stats(),
+        "table_version": data_version(),
+        "total_rows": total_rows,
+        "truncated": truncated,
+        "approximate": intent.approximate and engine == "bigquery" and view is None,
+        "materialized_view": view.name if view is not None and engine == "bigquery" else None,
+        "time_series": plan.series,
+    }
+
+    if stream:
+        response["row_iter"] = iter_result_rows(result, limit=total_rows)
+        return response
+
+    next_offset = offset + limit
+    response["rows"] = result_page(result, offset, max(min(limit, total_rows - offset), 0))
+    response["page"] = {
+        "offset": offset,
+        "page_size": limit,
+        "next_offset": next_offset if next_offset < total_rows else None,
+    }
+    return response
+
+
+def ndjson_lines(response: Dict[str, Any]) -> Iterator[str]:
+    """
+    First line: response metadata. Then one JSON line per row.
+    """
+    row_iter = response.pop("row_iter")
+    yield json.dumps(response, default=str) + "\n"
+    for row in row_iter:
+        yield json.dumps(row, default=str) + "\n"
+
+
+def question_warnings(intent: Intent) -> List[str]:
+    warnings = []
+    if intent.breakdown and not intent.dimensions and not intent.period:
+        warnings.append("Requested grouping not recognized; returning overall metric.")
+    return warnings
+
+
+# ------------------------------
+# BATCH MODE (ONE SCAN PER TIME WINDOW)
+# ------------------------------
+def build_batch_sql(
+    metrics: List[str],
+    groupings: List[Tuple[str, ...]],
+    time_window: Optional[str],
+    filter_columns: Optional[List[str]] = None,
+    ranks: Sequence[Tuple[str, str, int]] = (),
+) -> str:
+    """
+    One GROUPING SETS query covering every grouping asked for in a batch.
+    g_<dim> = 0 marks rows grouped by that dimension; all 1 = overall row.
+
+    Each grouping set keeps at most MAX_RESULT_ROWS + 1 rows (in dimension
+    order, so truncation can be detected), plus the top N rows of every
+    (metric alias, order, N) ranking asked for in the batch. rn_0 / rn_<i>
+    number the rows in each order (see batch_row_number).
+    """
+    dims = sorted({d for g in groupings for d in g})
+    sets = [f"({', '.join(g)})" for g in sorted(set(groupings)) if g]
+    if () in groupings:
+        sets.append("()")
+
+    select_parts = [f"GROUPING({d}) AS g_{d}" for d in dims] + dims + metrics
+    time_filter = where_sql(time_window, filter_columns or [])
+
+    sql = f"""
+    SELECT
+        {", ".join(select_parts)}
+    FROM `{FULL_TABLE_ID}`
+    """
+
+    if time_filter:
+        sql += f"\nWHERE {time_filter}"
+
+    if not dims:
+        return sql.strip()
+    sql += f"\nGROUP BY GROUPING SETS ({', '.join(sets)})"
+
+    grouping_set = ", ".join(f"g_{d}" for d in dims)
+    ties = ", ".join(dims)
+    row_numbers = [f"ROW_NUMBER() OVER (PARTITION BY {grouping_set} ORDER BY {ties}) AS rn_0"]
+    keep = [f"rn_0 <= {MAX_RESULT_ROWS + 1}"]
+    for i, (alias, order, n) in enumerate(sorted(set(ranks)), start=1):
+        row_numbers.append(
+            f"ROW_NUMBER() OVER (PARTITION BY {grouping_set} "
+            f"ORDER BY {alias} {order.upper()}, {ties}) AS rn_{i}"
+        )
+        keep.append(f"rn_{i} <= {n}")
+
+    columns = (
+        [f"g_{d}" for d in dims] + dims + [metric_alias(m) for m in metrics]
+        + [f"rn_{i}" for i in range(len(row_numbers))]
+    )
+    capped = f"""
+    SELECT
+        {", ".join(columns)}
+    FROM (
+        SELECT *, {", ".join(row_numbers)}
+        FROM ({sql.strip()})
+    )
+    WHERE {" OR ".join(keep)}
+    """
+    return capped.strip()
+
+
+def compile_batch(
+    metrics: List[str],
+    groupings: List[Tuple[str, ...]],
+    time_window: Optional[str],
+    filter_columns: Optional[List[str]] = None,
+    ranks: Sequence[Tuple[str, str, int]] = (),
+) -> str:
+    key = "batch|" + "|".join(
+        [time_window or "", ",".join(filter_columns or [])]
+        + sorted(set(metrics))
+        + sorted({",".join(g) for g in groupings})
+        + sorted({f"{alias} {order} {n}" for alias, order, n in ranks})
+    )
+    key = f"{active_engine()}|{key}"
+    version = data_version()
+
+    sql = PLAN_CACHE.get(key, tag=version)
+    if sql is not None:
+        return sql
+
+    sql = build_batch_sql(sorted(set(metrics)), groupings, time_window, filter_columns, ranks)
+    validate_sql_ast(sql)
+    PLAN_CACHE.put(key, sql, tag=version)
+    return sql
+
+
+def batch_row_number(
+    ranks: Sequence[Tuple[str, str, int]], intent: Intent
+) -> Tuple[str, int]:
+    """
+    Row number column of build_batch_sql holding this question's rows, and
+    how many of them it keeps.
+    """
+    if not intent.order:
+        return "rn_0", MAX_RESULT_ROWS + 1
+    rank = (metric_alias(intent.metric), intent.order, intent.top_n)
+    return f"rn_{sorted(set(ranks)).index(rank) + 1}", intent.top_n
+
+
+def split_batch_rows(
+    rows: List[Dict[str, Any]],
+    dims: List[str],
+    grouping: Tuple[str, ...],
+    alias: str,
+    row_number: Optional[Tuple[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    wanted = set(grouping)
+    matched = [r for r in rows if {d for d in dims if r.get(f"g_{d}") == 0} == wanted]
+    if row_number is not None:
+        column, keep = row_number
+        matched = sorted((r for r in matched if r[column] <= keep), key=lambda r: r[column])
+
+    return [{**{d: row[d] for d in grouping}, alias: row[alias]} for row in matched]
+
+
+def ask_agent_batch(questions: List[str]) -> Dict[str, Any]:
+    """
+    Answers many questions at once. Questions the cube can answer are served
+    locally; the rest are grouped by time window (and value filters) so each
+    group costs a single BigQuery scan instead of one scan per question.
+    """
+    ensure_engine()
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    pending: Dict[Tuple[Optional[str], Tuple[Tuple[str, str], ...]], List[Tuple[int, Intent]]] = {}
+
+    jobs = 0
+    for i, question in enumerate(questions):
+        intent = resolve_intent(question)
+        if intent.period:
+            # Trends are answered from their own month buckets
+            series: Dict[str, Any] = {}
+            rows, engine = answer_time_series(intent, series_info=series), active_engine()
+            jobs += 1 if series.get("fetched_months") else 0
+        else:
+            rows, engine = answer_from_cube(intent), "cube"
+
+        if rows is not None:
+            sql = compile_intent(intent)
+            results[i] = {
+                "question": question,
+                "sql": sql,
+                "rows": rows[:MAX_RESULT_ROWS],
+                "truncated": len(rows) > MAX_RESULT_ROWS,
+                "engine": engine,
+                "confidence_score": confidence_score(sql, intent),
+                "warnings": question_warnings(intent),
+            }
+        else:
+            pending.setdefault((intent.time_window, intent.filters), []).append((i, intent))
+
+    for (time_window, filters), items in pending.items():
+        metrics = [intent.metric for _, intent in items]
+        groupings = [intent.dimensions for _, intent in items]
+        ranks = [
+            (metric_alias(intent.metric), intent.order, intent.top_n)
+            for _, intent in items if intent.order
+        ]
+        sql = compile_batch(metrics, groupings, time_window, [c for c, _ in filters], ranks)
+        started, cost = time.perf_counter(), {}
+        rows = run_query_cached(sql, params=intent_params(items[0][1]), info=cost)
+        jobs += 1
+
+        record_query(
+            "\n".join(questions[i] for i, _ in items),
+            "batch|" + "|".join(sorted({plan_key(intent) for _, intent in items})),
+            ",".join(sorted({metric_alias(m) for m in metrics})),
+            ";".join(sorted({",".join(g) for g in groupings})),
+            time_window, active_engine(), cost, started, len(rows),
+        )
+
+        dims = sorted({d for g in groupings for d in g})
+        for i, intent in items:
+            split = split_batch_rows(
+                rows, dims, intent.dimensions, metric_alias(intent.metric),
+                row_number=batch_row_number(ranks, intent) if dims else None,
+            )
+            results[i] = {
+                "question": questions[i],
+                "sql": sql,
+                "rows": rank_rows(split, intent)[:MAX_RESULT_ROWS],
+                "truncated": not intent.order and len(split) > MAX_RESULT_ROWS,
+                "engine": active_engine(),
+                "confidence_score": confidence_score(sql, intent),
+                "warnings": question_warnings(intent),
+            }
+
+    return {
+        "results": results,
+        "bigquery_jobs": jobs,
+        "cache_size": QUERY_RESULT_CACHE.stats(),
+        "table_version": data_version(),
+    }
+
+
+# ------------------------------
+# TELEMETRY (SLOW / EXPENSIVE PLANS)
+# ------------------------------
+def get_telemetry() -> Optional["TelemetryStore"]:
+    global TELEMETRY
+    if not ENABLE_TELEMETRY:
+        return None
+
+    if TELEMETRY is None:
+        with _telemetry_lock:
+            if TELEMETRY is None:
+                from telemetry import TelemetryStore
+                TELEMETRY = TelemetryStore(TELEMETRY_DB_PATH, sample_rate=TELEMETRY_SAMPLE_RATE)
+    return TELEMETRY
+
+
+def record_query(
+    question: str,
+    signature: str,
+    metric: str,
+    dimensions: str,
+    time_window: Optional[str],
+    engine: str,
+    cost: Dict[str, Any],
+    started: float,
+    row_count: int,
+    intent: Optional[Intent] = None,
+):
+    """
+    Queues one telemetry event (sampled; never blocks or fails the request).
+    The intent of single-question plans is stored for the pre-warm list.
+    """
+    try:
+        store = get_telemetry()
+        if store is None:
+            return
+
+        from telemetry import question_hash
+
+        store.record(
+            question_hash=question_hash(question),
+            plan_signature=signature,
+            metric=metric,
+            dimensions=dimensions,
+            time_window=time_window or "",
+            engine=engine,
+            latency_ms=round((time.perf_counter() - started) * 1000, 2),
+            cache_hit=int(engine.startswith("cube") or bool(cost.get("cache_hit"))),
+            bytes_processed=int(cost.get("bytes_processed") or 0),
+            bytes_billed=int(cost.get("bytes_billed") or 0),
+            slot_ms=int(cost.get("slot_ms") or 0),
+            row_count=row_count,
+            intent=json.dumps(intent._asdict()) if intent is not None else None,
+        )
+    except Exception:
+        logger.exception("Telemetry record failed")
+
+
+def telemetry_report(limit: int = 10, since_hours: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Top plans by cost and latency on this instance, with pre-warm and
+    materialization suggestions.
+    """
+    store = get_telemetry()
+    if store is None:
+        return {"error": "Telemetry disabled"}
+
+    from telemetry import report
+
+    since = since_hours * 3600 if since_hours else None
+    result = report(TELEMETRY_DB_PATH, limit=limit, since_seconds=since)
+    result["telemetry"] = store.stats()
+    return result
+
+
+# ------------------------------
+# CACHE PRE-WARM (NEW INSTANCES)
+# ------------------------------
+def prewarm_list(limit: int = PREWARM_TOP_K, since_hours: Optional[float] = None) -> Any:
+    """
+    This instance's most frequent plans, in the pre-warm list format.
+    """
+    if get_telemetry() is None:
+        return {"error": "Telemetry disabled"}
+
+    from telemetry import top_intents
+
+    # Best effort: a stuck writer must not hang the request
+    get_telemetry().flush(timeout=TELEMETRY_FLUSH_SECONDS)
+    since = since_hours * 3600 if since_hours else None
+    return top_intents(TELEMETRY_DB_PATH, limit=limit, since_seconds=since)
+
+
+def load_prewarm_plans(path: str = PREWARM_PLANS_PATH) -> List[Intent]:
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    plans = []
+    for entry in entries[:PREWARM_TOP_K]:
+        try:
+            plans.append(intent_from_dict(entry["intent"]))
+        except (KeyError, TypeError):
+            logger.warning("Skipping malformed pre-warm entry: %s", entry)
+    return plans
+
+
+def prewarm_plan(intent: Intent, budget: Dict[str, Any]) -> str:
+    """
+    Runs one plan into the result (or trend) cache. Returns the outcome.
+    """
+    if time.monotonic() >= budget["deadline"]:
+        return "skipped_time"
+
+    try:
+        sql = compile_intent(intent)
+        params = intent_params(intent)
+        if not intent.period and answer_from_cube(intent) is not None:
+            return "cube"
+
+        estimate = None
+        if active_engine() == "bigquery":
+            estimate = estimate_query_bytes(sql, params)
+        with _prewarm_lock:
+            if budget["bytes"] + (estimate or 0) > PREWARM_MAX_BYTES:
+                return "skipped_bytes"
+            budget["bytes"] += estimate or 0
+
+        cost: Dict[str, Any] = {}
+        if intent.period:
+            answer_time_series(intent, info=cost)
+        else:
+            fetch_result(sql, info=cost, params=params)
+
+        if estimate is None:
+            # No dry run: charge what the query actually scanned
+            with _prewarm_lock:
+                budget["bytes"] += int(cost.get("bytes_processed") or 0)
+        return "warmed"
+    except Exception:
+        logger.exception("Pre-warm failed for %s", plan_key(intent))
+        return "failed"
+
+
+def prewarm_cache():
+    """
+    Runs the top persisted plans concurrently so the first users after a
+    scale-out hit a warm cache. Runs in its own thread and never delays
+    readiness. No plan starts after PREWARM_SECONDS or once the estimated
+    scan would pass PREWARM_MAX_BYTES.
+    """
+    started = time.monotonic()
+    plans = load_prewarm_plans()
+    if not plans:
+        return
+
+    try:
+        ensure_engine()
+    except Exception:
+        logger.exception("Pre-warm skipped: engine unavailable")
+        return
+
+    budget = {"deadline": started + PREWARM_SECONDS, "bytes": 0}
+    with ThreadPoolExecutor(max_workers=PREWARM_WORKERS, thread_name_prefix="prewarm") as pool:
+        outcomes = list(pool.map(lambda intent: prewarm_plan(intent, budget), plans))
+
+    PREWARM_STATS.update({
+        "plans": len(plans),
+        **{outcome: outcomes.count(outcome) for outcome in set(outcomes)},
+        "bytes": budget["bytes"],
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    })
+    logger.info("prewarm_report %s", json.dumps(PREWARM_STATS, sort_keys=True))
+
+
+# ------------------------------
+# HTTP ENTRY POINT
+# ------------------------------
+def handle_get(args) -> Tuple[int, Any]:
+    """
+    GET routes shared by the Flask and ASGI entry points (args: str -> str).
+    Insight lookup: ?insight_id=...
+    Slow / expensive plan report: ?report=plans[&limit=N][&since_hours=H]
+    Materialized view advice (with DDL): ?report=views[&since_hours=H]
+    Pre-warm list (save as prewarm_plans.json): ?report=prewarm[&limit=N]
+    """
+    report = args.get("report")
+    if report:
+        try:
+            since_hours = float(args["since_hours"]) if args.get("since_hours") else None
+            limit = int(args["limit"]) if args.get("limit") else None
+        except ValueError:
+            return 400, {"error": "limit and since_hours must be numbers"}
+        if (since_hours is not None and not since_hours > 0) or (limit is not None and limit <= 0):
+            return 400, {"error": "limit and since_hours must be positive"}
+
+        if report == "views":
+            return 200, view_advice(since_hours=since_hours)
+        if report == "prewarm":
+            return 200, prewarm_list(limit=limit or PREWARM_TOP_K, since_hours=since_hours)
+        return 200, telemetry_report(limit=limit or 10, since_hours=since_hours)
+
+    insight_id = (args.get("insight_id") or "").strip()
+    if not insight_id:
+        return 400, {"error": "Missing insight_id"}
+    return 200, get_insight(insight_id)
+
+
+def batch_questions(payload: Dict[str, Any]) -> List[str]:
+    questions = payload.get("questions") or []
+    return [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+
+
+def payload_int(payload: Dict[str, Any], name: str) -> Optional[int]:
+    """
+    Integer field of a POST payload (None when absent); ValueError when
+    it is not a whole number.
+    """
+    value = payload.get(name)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer") from None
+
+
+def page_args(payload: Dict[str, Any]) -> Tuple[int, Optional[int]]:
+    """
+    (offset, page_size) of a payload that passed request_error().
+    """
+    return payload_int(payload, "offset") or 0, payload_int(payload, "page_size")
+
+
+def request_error(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Validation message for a bad POST payload (HTTP 400), else None.
+    """
+    engine = payload.get("engine")
+    if engine is not None and str(engine).lower() not in QUERY_ENGINES:
+        return f"Unknown engine: {engine}"
+
+    try:
+        offset, page_size = page_args(payload)
+    except ValueError as e:
+        return str(e)
+    if offset < 0:
+        return "offset must be >= 0"
+    if page_size is not None and not 1 <= page_size <= MAX_PAGE_SIZE:
+        return f"page_size must be between 1 and {MAX_PAGE_SIZE}"
+
+    if payload.get("questions") is not None:
+        questions = batch_questions(payload)
+        if not questions:
+            return "Missing questions"
+        if len(questions) > BATCH_MAX_QUESTIONS:
+            return f"Too many questions (max {BATCH_MAX_QUESTIONS})"
+        return None
+
+    if not payload.get("question", "").strip():
+        return "Missing question"
+    return None
+
+
+def entry_point(request):
+    from flask import Response, jsonify, make_response
+
+    # CORS preflight
+    if request.method == "OPTIONS":
+        resp = make_response("", 204)
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
         resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
         return resp
 
+    request_started = time.perf_counter()
     try:
+        if request.method == "GET":
+            status, body = handle_get(request.args)
+            resp = make_response(jsonify(body), status)
+            resp.headers["Access-Control-Allow-Origin"] = "*"
+            return resp
+
         payload = request.get_json(silent=True) or {}
         question = payload.get("question", "").strip()
-
-        if not question:
-            resp = make_response(jsonify({"error": "Missing question"}), 400)
+        engine = payload.get("engine")
+
+        error = request_error(payload)
+        if error:
+            resp = make_response(jsonify({"error": error}), 400)
+        elif payload.get("questions") is not None:
+            with use_engine(engine):
+                batch = ask_agent_batch(batch_questions(payload))
+            resp = make_response(jsonify(batch), 200)
+        elif payload.get("format") == "ndjson":
+            with use_engine(engine):
+                result = ask_agent(question, stream=True)
+            resp = Response(ndjson_lines(result), mimetype="application/x-ndjson")
         else:
-            resp = make_response(jsonify(ask_agent(question)), 200)
+            offset, page_size = page_args(payload)
+            with use_engine(engine):
+                result = ask_agent(question, offset=offset, page_size=page_size)
+            resp = make_response(jsonify(result), 200)
 
         resp.headers["Access-Control-Allow-Origin"] = "*"
         resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
-        resp.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        report_first_request(request_started)
+        return resp
+
+    except QueryBudgetExceeded as e:
+        logger.warning("Rejected over-budget query: %s", e)
+        resp = make_response(
+            jsonify({"error": str(e), "estimated_bytes": e.estimated_bytes, "byte_budget": e.budget}),
+            400,
+        )
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+        return resp
+
+    except LocalEngineUnavailable as e:
+        logger.warning("Local engine unavailable: %s", e)
+        resp = make_response(jsonify({"error": "local engine unavailable"}), 400)
+        resp.headers["Access-Control-Allow-Origin"] = "*"
         return resp
 
     except Exception as e:
@@ -336,3 +2580,74 @@ def entry_point(request):
         resp = make_response(jsonify({"error": str(e)}), 500)
         resp.headers["Access-Control-Allow-Origin"] = "*"
         return resp
+
+
+# ------------------------------
+# STARTUP (COLD START)
+# ------------------------------
+def report_first_request(request_started: float):
+    """
+    Logs one structured cold-start line per instance, for tracking
+    import / first-request latency across releases (log-based metrics).
+    """
+    global _first_request_seen
+    if _first_request_seen:
+        return
+    _first_request_seen = True
+
+    now = time.perf_counter()
+    STARTUP_TIMINGS["first_request_ms"] = round((now - request_started) * 1000, 1)
+    STARTUP_TIMINGS["instance_age_ms"] = round((now - _IMPORT_STARTED) * 1000, 1)
+    logger.info("cold_start_report %s", json.dumps(STARTUP_TIMINGS, sort_keys=True))
+
+
+def background_warmup():
+    try:
+        # Pay the sqlglot import here rather than on the first request
+        import sqlglot  # noqa: F401
+
+        if QUERY_ENGINE == "local":
+            # No BigQuery access assumed (air-gapped replica)
+            ensure_local_engine()
+            return
+
+        if STARTUP_TIMINGS["schema_source"] == "snapshot":
+            refresh_schema()
+
+        maybe_refresh_spend_cube()
+        maybe_refresh_value_dictionary()
+    except Exception:
+        logger.exception("Background warm-up failed; will retry on demand")
+
+
+def startup():
+    """
+    snapshot mode: schema comes from the bundled file so the instance is
+    ready immediately; the live schema and table version load in background.
+    blocking mode (or no snapshot): get_table runs before serving.
+    """
+    global _table_version_checked_at
+
+    if SCHEMA_STARTUP_MODE == "snapshot" and load_schema_snapshot():
+        STARTUP_TIMINGS["schema_source"] = "snapshot"
+        # The warm-up loads the table version; requests must not block on
+        # their own get_table before it does
+        _table_version_checked_at = time.monotonic()
+    elif QUERY_ENGINE == "local":
+        STARTUP_TIMINGS["schema_source"] = "parquet"
+        ensure_local_engine()
+    else:
+        STARTUP_TIMINGS["schema_source"] = "bigquery"
+        load_schema_once()
+
+    threading.Thread(target=background_warmup, daemon=True).start()
+    if ENABLE_PREWARM:
+        threading.Thread(target=prewarm_cache, name="prewarm", daemon=True).start()
+    STARTUP_TIMINGS["import_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+
+
+startup()
+
+
+if __name__ == "__main__":
+    write_schema_snapshot()
@@ -0,0 +1,163 @@
+# mv_advisor.py
+import argparse
+import json
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Views are aggregated per PO day, so any PO-date window stays exact
+VIEW_DATE_COLUMN = "po_dt"
+
+# Metric alias -> column holding its partial aggregate in a view
+VIEW_MEASURES = {
+    "count": "row_count",
+    "spend": "spend",
+    "volume": "volume",
+    "savings": "savings",
+}
+
+
+class ViewSpec(NamedTuple):
+    name: str
+    dimensions: Tuple[str, ...]
+    measures: Tuple[str, ...]       # metric aliases the view can answer
+
+    @property
+    def columns(self) -> List[str]:
+        return [*self.dimensions, VIEW_DATE_COLUMN, *(VIEW_MEASURES[m] for m in self.measures)]
+
+
+def view_name(dimensions: Sequence[str]) -> str:
+    return "mv_spend_" + ("_".join(dimensions) if dimensions else "total")
+
+
+def view_ddl(
+    view_id: str,
+    table_id: str,
+    dimensions: Sequence[str],
+    po_expr: str,
+    measure_exprs: Dict[str, str],
+    refresh_minutes: int = 60,
+) -> str:
+    """
+    CREATE MATERIALIZED VIEW statement for one dimension set.
+    measure_exprs maps metric alias -> aggregate over the base table.
+    """
+    po_expr = " ".join(po_expr.split())
+    select = [
+        *dimensions,
+        f"{po_expr} AS {VIEW_DATE_COLUMN}",
+        *(f"{expr} AS {VIEW_MEASURES[alias]}" for alias, expr in measure_exprs.items()),
+    ]
+    group_by = [*dimensions, po_expr]
+    return (
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS `{view_id}`\n"
+        f"OPTIONS (enable_refresh = true, refresh_interval_minutes = {refresh_minutes})\n"
+        f"AS SELECT\n    " + ",\n    ".join(select) + "\n"
+        f"FROM `{table_id}`\n"
+        f"GROUP BY " + ", ".join(group_by)
+    )
+
+
+def hot_dimension_sets(
+    plans: List[Dict[str, Any]],
+    min_calls: int,
+    min_bytes: int,
+) -> List[Dict[str, Any]]:
+    """
+    Dimension sets whose plans (any metric or window) are asked at least
+    min_calls times and scan at least min_bytes in total, hottest first.
+    Batch plans are skipped; their dimension sets show up individually.
+    """
+    totals: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+    for plan in plans:
+        if plan["plan_signature"].startswith("batch|"):
+            continue
+        dims = tuple(d for d in (plan["dimensions"] or "").split(",") if d)
+        entry = totals.setdefault(dims, {
+            "dimensions": dims, "calls": 0, "bytes_processed": 0, "plans": [],
+        })
+        entry["calls"] += plan["calls"]
+        entry["bytes_processed"] += plan["bytes_processed"]
+        entry["plans"].append(plan["plan_signature"])
+
+    hot = [
+        e for e in totals.values()
+        if e["calls"] >= min_calls and e["bytes_processed"] >= min_bytes
+    ]
+    return sorted(hot, key=lambda e: (e["bytes_processed"], e["calls"]), reverse=True)
+
+
+class ViewRouter:
+    """
+    Registry of deployed materialized views. route() picks the narrowest
+    view covering a plan's dimensions, filter columns and metric.
+    """
+
+    def __init__(self, views: Optional[List[ViewSpec]] = None):
+        self.views = {v.name.lower(): v for v in views or []}
+
+    @classmethod
+    def load(cls, path: str) -> "ViewRouter":
+        """
+        Registry from path; empty when the file is missing or malformed
+        (queries then read the base table).
+        """
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+            views = [
+                ViewSpec(e["name"], tuple(e.get("dimensions", ())), tuple(e.get("measures", ())))
+                for e in entries
+            ]
+            unknown = {m for v in views for m in v.measures} - set(VIEW_MEASURES)
+            if unknown:
+                raise ValueError(f"unknown measures {sorted(unknown)}")
+        except OSError:
+            return cls()
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.exception("Invalid view registry %s; no views will be used", path)
+            return cls()
+
+        return cls(views)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump([v._asdict() for v in self.views.values()], f, indent=2)
+
+    def get(self, name: str) -> Optional[ViewSpec]:
+        return self.views.get(name.lower())
+
+    def route(
+        self, metric_alias: str, dimensions: Sequence[str], filter_columns: Sequence[str]
+    ) -> Optional[ViewSpec]:
+        needed = set(dimensions) | set(filter_columns)
+        matches = [
+            v for v in self.views.values()
+            if metric_alias in v.measures and needed <= set(v.dimensions)
+        ]
+        return min(matches, key=lambda v: len(v.dimensions), default=None)
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+
+if __name__ == "__main__":
+    # python mv_advisor.py [--write materialized_views.json]
+    # Prints view advice from this instance's telemetry (imports main for
+    # the live schema and config).
+    parser = argparse.ArgumentParser(description="Materialized views for hot Spend plans")
+    parser.add_argument("--write", help="register the suggested views in this file")
+    args = parser.parse_args()
+
+    import main
+
+    advice = main.view_advice()
+    print(json.dumps(advice, indent=2, default=str))
+
+    if args.write:
+        ViewRouter([
+            ViewSpec(c["name"], tuple(c["dimensions"]), tuple(c["measures"]))
+            for c in advice["candidates"]
+        ]).save(args.write)
@@ -0,0 +1,207 @@
+# result_cache.py
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# How many of the least-recently-used entries are considered per eviction.
+# The victim is the one with the worst bytes-per-hit ratio among them, so
+# large result sets that are rarely reused go first.
+EVICTION_SAMPLE = 8
+
+
+def estimate_bytes(value: Any) -> int:
+    """
+    Approximate in-memory footprint of a cached result.
+    Columnar results (Arrow tables) report their buffer size; row lists use
+    the JSON size, which tracks what we ship back to the caller.
+    """
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return len(repr(value))
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "hits", "tag")
+
+    def __init__(self, value: Any, size: int, expires_at: float, tag: Optional[str]):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.hits = 0
+        self.tag = tag
+
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache for query results.
+
+    Limits both the number of entries and their total estimated size.
+    Thread-safe; one instance is shared by all requests in a container.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ------------------------------
+    # PUBLIC API
+    # ------------------------------
+    def get(self, key: str, tag: Optional[str] = None) -> Optional[Any]:
+        """
+        Returns the cached value, or None on miss.
+        If tag is given, entries stored under a different tag count as stale.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            if tag is not None and entry.tag != tag:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            entry.hits += 1
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry.value
+
+    def put(
+        self,
+        key: str,
+        value: Any,
+        ttl_seconds: Optional[float] = None,
+        tag: Optional[str] = None,
+    ) -> bool:
+        """
+        Stores a value. Returns False if the value alone exceeds the byte budget.
+        tag records the data version the value was computed from.
+        """
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            return False
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        entry = _Entry(value, size, time.monotonic() + ttl, tag)
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = entry
+            self._bytes += size
+            self._enforce_limits(protect=key)
+        return True
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_stale(self, current_tag: str) -> int:
+        """
+        Drops every entry not computed from current_tag. Returns the count.
+        """
+        with self._lock:
+            stale = [k for k, e in self._data.items() if e.tag != current_tag]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    # ------------------------------
+    # INTERNALS (lock must be held)
+    # ------------------------------
+    def _remove(self, key: str) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        expired = [k for k, e in self._data.items() if e.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+            self.expirations += 1
+
+    def _over_limit(self) -> bool:
+        return len(self._data) > self.max_entries or self._bytes > self.max_bytes
+
+    def _enforce_limits(self, protect: str) -> None:
+        if not self._over_limit():
+            return
+
+        self._purge_expired()
+
+        while self._over_limit() and len(self._data) > 1:
+            victim = None
+            worst = -1.0
+            for i, (key, entry) in enumerate(self._data.items()):
+                if i >= EVICTION_SAMPLE:
+                    break
+                if key == protect:
+                    continue
+                score = entry.size / (entry.hits + 1)
+                if score > worst:
+                    worst = score
+                    victim = key
+
+            if victim is None:
+                break
+
+            self._remove(victim)
+            self.evictions += 1
@@ -0,0 +1,232 @@
+# shared_cache.py
+import abc
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Payload format markers (first byte)
+_ARROW = b"A"
+_JSON = b"J"
+
+# Results larger in memory than max_payload_bytes times this are skipped
+# without encoding: compression rarely does better on result tables
+MAX_COMPRESSION_RATIO = 4
+
+# Rows serialized to estimate the size of a row-list result
+SIZE_SAMPLE_ROWS = 100
+
+
+def cache_key(version: str, canonical: str) -> str:
+    """
+    Shared key for a canonical SQL (+ params) at a table version. The
+    version is part of the key, so a table change never serves old data.
+    """
+    digest = hashlib.sha256(f"{version}|{canonical}".encode()).hexdigest()
+    return f"spend:{digest}"
+
+
+# ------------------------------
+# PAYLOADS
+# ------------------------------
+def encode_result(result: Any) -> bytes:
+    """
+    Arrow IPC stream (zstd) when pyarrow is available; row lists are
+    converted to Arrow first so column types survive the round trip.
+    Falls back to zlib-compressed JSON.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return _JSON + zlib.compress(json.dumps(result, default=str).encode())
+
+    table = result if isinstance(result, pa.Table) else pa.Table.from_pylist(result)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return _ARROW + sink.getvalue().to_pybytes()
+
+
+def estimated_size(result: Any) -> int:
+    """
+    Uncompressed size of a result without encoding it: Arrow buffer sizes,
+    or for row lists the JSON size of a sample scaled to all rows.
+    """
+    nbytes = getattr(result, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+
+    sample = result[:SIZE_SAMPLE_ROWS]
+    if not sample:
+        return 0
+    return len(json.dumps(sample, default=str)) * len(result) // len(sample)
+
+
+def decode_result(payload: bytes) -> Any:
+    marker, body = payload[:1], payload[1:]
+    if marker == _ARROW:
+        import pyarrow as pa
+        return pa.ipc.open_stream(body).read_all()
+    if marker == _JSON:
+        return json.loads(zlib.decompress(body))
+    raise ValueError(f"Unknown shared cache payload format: {marker!r}")
+
+
+# ------------------------------
+# BACKENDS
+# ------------------------------
+class SharedCache(abc.ABC):
+    """
+    Second-tier result cache shared by all instances: a plain key/value
+    store of compressed payloads with a TTL. Backends implement _get/_set;
+    errors are logged and count as misses, never failing a request.
+    """
+
+    def __init__(self, max_payload_bytes: int = 8 * 1024 * 1024):
+        self.max_payload_bytes = max_payload_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            payload = self._get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            result = decode_result(payload)
+        except Exception:
+            logger.exception("Shared cache read failed")
+            self.errors += 1
+            return None
+
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Any, ttl_seconds: float) -> bool:
+        try:
+            if estimated_size(result) > self.max_payload_bytes * MAX_COMPRESSION_RATIO:
+                self.skipped += 1
+                return False
+
+            payload = encode_result(result)
+            if len(payload) > self.max_payload_bytes:
+                self.skipped += 1
+                return False
+            self._set(key, payload, ttl_seconds)
+        except Exception:
+            logger.exception("Shared cache write failed")
+            self.errors += 1
+            return False
+
+        self.writes += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "skipped": self.skipped,
+            "errors": self.errors,
+        }
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    def _set(self, key: str, payload: bytes, ttl_seconds: float) -> None:
+        ...
+
+
+class SQLiteSharedCache(SharedCache):
+    """
+    SQLite file backend, for tests and single-host setups (instances that
+    share a filesystem share the cache). Expired rows are purged on write.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache "
+                "(key TEXT PRIMARY KEY, payload BLOB, expires_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT payload FROM shared_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, payload: bytes, ttl_seconds: float) -> None:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "INSERT OR REPLACE INTO shared_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(payload), now + ttl_seconds),
+        )
+        conn.commit()
+
+
+class RedisSharedCache(SharedCache):
+    """
+    Redis (or any Redis-protocol store, e.g. Memorystore) backend.
+    Short socket timeouts keep a slow cache from slowing down requests.
+    """
+
+    def __init__(self, url: str, timeout_seconds: float = 0.5, **kwargs):
+        super().__init__(**kwargs)
+        import redis
+
+        self._client = redis.Redis.from_url(
+            url, socket_timeout=timeout_seconds, socket_connect_timeout=timeout_seconds
+        )
+
+    def _get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def _set(self, key: str, payload: bytes, ttl_seconds: float) -> None:
+        self._client.set(key, payload, ex=max(int(ttl_seconds), 1))
+
+
+def open_shared_cache(url: str, **kwargs) -> Optional[SharedCache]:
+    """
+    redis://host:6379/0 (or rediss://) -> RedisSharedCache
+    sqlite:///path/to/file.sqlite       -> SQLiteSharedCache
+    empty                               -> None (shared tier disabled)
+    """
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSharedCache(url, **kwargs)
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        return SQLiteSharedCache(os.path.expanduser(path), **kwargs)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL: {url}")
@@ -0,0 +1,311 @@
+# spend_cube.py
+import logging
+import threading
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Slot month index used for rows without a parseable PO date
+UNDATED = -1
+
+
+class CubeTooLarge(ValueError):
+    """The cube would hold more than max_cells cells."""
+
+
+def month_index(day: Optional[date]) -> int:
+    if day is None:
+        return UNDATED
+    return day.year * 12 + (day.month - 1)
+
+
+class _DimensionSlice:
+    """
+    Sparse (code x month x in_window) cells for one dimension, as parallel
+    NumPy arrays. Code 0 of the overall slice is the single "total" row.
+    """
+
+    def __init__(self, codes: List[Any], measures: List[str]):
+        self.codes = codes
+        self.code_ids = {c: i for i, c in enumerate(codes)}
+        self.code_idx = np.zeros(0, dtype=np.int32)
+        self.month_idx = np.zeros(0, dtype=np.int32)
+        self.in_window = np.zeros(0, dtype=bool)
+        self.values = {m: np.zeros(0, dtype=np.float64) for m in measures}
+
+    @property
+    def cells(self) -> int:
+        return int(self.code_idx.shape[0])
+
+
+class SpendCube:
+    """
+    In-memory pre-aggregated spend cube.
+
+    Holds SUM/COUNT measures per dimension value x PO month, built with a
+    single GROUPING SETS scan. Each cell also records whether it falls inside
+    the current "last 12 months" window, so windowed questions stay exact.
+    """
+
+    def __init__(
+        self,
+        table_id: str,
+        dimensions: List[str],
+        measures: Dict[str, str],
+        po_expr: str,
+        query_fn: Callable[[str], List[Dict[str, Any]]],
+        max_cells: int = 2_000_000,
+    ):
+        self.table_id = table_id
+        self.dimensions = dimensions
+        self.measures = measures
+        self.po_expr = po_expr
+        self.query_fn = query_fn
+        self.max_cells = max_cells
+
+        self.version: str = ""
+        self.window_start: Optional[date] = None
+        self.row_count = 0
+        # PO month -> content fingerprint the cube was aggregated from
+        self.fingerprint: Dict[date, Any] = {}
+        self._slices: Dict[Optional[str], _DimensionSlice] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------
+    # BUILD / REFRESH
+    # ------------------------------
+    def build_sql(self, window_start: Optional[date], from_month: Optional[date] = None) -> str:
+        dims = ", ".join(self.dimensions)
+        in_window = (
+            f"IFNULL(po_dt_parsed >= DATE '{window_start.isoformat()}', FALSE)"
+            if window_start else "TRUE"
+        )
+        where = (
+            f"\nWHERE po_month IS NULL OR po_month >= DATE '{from_month.isoformat()}'"
+            if from_month else ""
+        )
+        groupings = ", ".join(f"GROUPING({d}) AS g_{d}" for d in self.dimensions)
+        sets = ", ".join(
+            [f"({d}, po_month, in_window)" for d in self.dimensions]
+            + ["(po_month, in_window)"]
+        )
+        measures = ", ".join(f"{expr} AS {name}" for name, expr in self.measures.items())
+
+        return f"""
+        WITH base AS (
+            SELECT *, DATE_TRUNC(po_dt_parsed, MONTH) AS po_month
+            FROM (
+                SELECT *, {self.po_expr} AS po_dt_parsed
+                FROM `{self.table_id}`
+            )
+        ),
+        flagged AS (
+            SELECT *, {in_window} AS in_window
+            FROM base{where}
+        )
+        SELECT
+            {groupings},
+            {dims}, po_month, in_window,
+            {measures}
+        FROM flagged
+        GROUP BY GROUPING SETS ({sets})
+        """
+
+    def build(
+        self,
+        version: str,
+        window_start: Optional[date],
+        row_count: int,
+        fingerprint: Optional[Dict[date, Any]] = None,
+    ):
+        rows = self.query_fn(self.build_sql(window_start))
+        slices = self._slices_from_rows(rows, base=None, drop_from=None)
+
+        with self._lock:
+            self._slices = slices
+            self.version = version
+            self.window_start = window_start
+            self.row_count = row_count
+            self.fingerprint = dict(fingerprint or {})
+
+        logger.info("Spend cube built for %s: %d cells", version, self.cells)
+
+    def refresh(
+        self,
+        version: str,
+        window_start: Optional[date],
+        row_count: int,
+        fingerprint: Optional[Dict[date, Any]] = None,
+    ):
+        """
+        Incremental refresh: re-aggregates only months from the old window
+        start onwards (where new loads land and in-window flags can move),
+        or from the earliest older month whose content fingerprint moved.
+        Falls back to a full build if the totals do not reconcile.
+        """
+        if not self._slices:
+            self.build(version, window_start, row_count, fingerprint)
+            return
+
+        anchors = [d for d in (self.window_start, window_start) if d]
+        if fingerprint is not None:
+            anchors += [
+                m for m in set(fingerprint) | set(self.fingerprint)
+                if fingerprint.get(m) != self.fingerprint.get(m)
+            ]
+        if not anchors:
+            self.build(version, window_start, row_count, fingerprint)
+            return
+
+        first = min(anchors)
+        from_month = date(first.year, first.month, 1)
+
+        rows = self.query_fn(self.build_sql(window_start, from_month=from_month))
+        slices = self._slices_from_rows(
+            rows, base=self._slices, drop_from=month_index(from_month)
+        )
+
+        if self._total_count(slices) != row_count:
+            logger.info("Spend cube totals drifted; rebuilding fully")
+            self.build(version, window_start, row_count, fingerprint)
+            return
+
+        with self._lock:
+            self._slices = slices
+            self.version = version
+            self.window_start = window_start
+            self.row_count = row_count
+            self.fingerprint = dict(fingerprint or {})
+
+        logger.info(
+            "Spend cube refreshed for %s from %s: %d cells",
+            version, from_month, self.cells,
+        )
+
+    # ------------------------------
+    # ANSWERING
+    # ------------------------------
+    def can_answer(self, measure: str, dimension: Optional[str], version: str) -> bool:
+        return (
+            self.version == version
+            and measure in self.measures
+            and dimension in self._slices
+        )
+
+    def answer(
+        self, measure: str, dimension: Optional[str], windowed: bool
+    ) -> List[Dict[str, Any]]:
+        cube_slice = self._slices[dimension]
+        n_codes = len(cube_slice.codes)
+
+        if windowed:
+            mask = cube_slice.in_window
+            codes = cube_slice.code_idx[mask]
+            counts = np.bincount(codes, minlength=n_codes)
+            values = np.bincount(
+                codes, weights=cube_slice.values[measure][mask], minlength=n_codes
+            )
+        else:
+            codes = cube_slice.code_idx
+            counts = np.bincount(codes, minlength=n_codes)
+            values = np.bincount(
+                codes, weights=cube_slice.values[measure], minlength=n_codes
+            )
+
+        def cast(v):
+            return int(v) if measure == "count" else float(v)
+
+        if dimension is None:
+            total = values[0] if n_codes else 0.0
+            return [{measure: cast(total)}]
+
+        return [
+            {dimension: cube_slice.codes[i], measure: cast(values[i])}
+            for i in np.flatnonzero(counts)
+        ]
+
+    # ------------------------------
+    # INTERNALS
+    # ------------------------------
+    @property
+    def cells(self) -> int:
+        return sum(s.cells for s in self._slices.values())
+
+    def _total_count(self, slices: Dict[Optional[str], _DimensionSlice]) -> int:
+        overall = slices.get(None)
+        if overall is None or "count" not in overall.values:
+            return -1
+        return int(overall.values["count"].sum())
+
+    def _slices_from_rows(
+        self,
+        rows: List[Dict[str, Any]],
+        base: Optional[Dict[Optional[str], _DimensionSlice]],
+        drop_from: Optional[int],
+    ) -> Dict[Optional[str], _DimensionSlice]:
+        grouped: Dict[Optional[str], List[Dict[str, Any]]] = {
+            d: [] for d in self.dimensions + [None]
+        }
+        for row in rows:
+            dim = next(
+                (d for d in self.dimensions if row.get(f"g_{d}") == 0), None
+            )
+            grouped[dim].append(row)
+
+        total_cells = sum(len(r) for r in grouped.values())
+        if base:
+            total_cells += sum(s.cells for s in base.values())
+        if total_cells > self.max_cells:
+            raise CubeTooLarge(f"Spend cube too large: {total_cells} cells")
+
+        slices = {}
+        for dim, dim_rows in grouped.items():
+            old = base.get(dim) if base else None
+            codes = list(old.codes) if old else ([None] if dim is None else [])
+            code_ids = dict(old.code_ids) if old else {c: i for i, c in enumerate(codes)}
+
+            new_code, new_month, new_flag = [], [], []
+            new_values = {m: [] for m in self.measures}
+            for row in dim_rows:
+                code = row.get(dim) if dim else None
+                if code not in code_ids:
+                    code_ids[code] = len(codes)
+                    codes.append(code)
+                new_code.append(code_ids[code])
+                new_month.append(month_index(row.get("po_month")))
+                new_flag.append(bool(row.get("in_window")))
+                for m in self.measures:
+                    new_values[m].append(float(row.get(m) or 0))
+
+            cube_slice = _DimensionSlice(codes, list(self.measures))
+            cube_slice.code_ids = code_ids
+
+            if old is not None:
+                # Undated rows are re-aggregated on every incremental refresh
+                keep = (old.month_idx < drop_from) & (old.month_idx != UNDATED)
+                cube_slice.code_idx = np.concatenate(
+                    [old.code_idx[keep], np.asarray(new_code, dtype=np.int32)]
+                )
+                cube_slice.month_idx = np.concatenate(
+                    [old.month_idx[keep], np.asarray(new_month, dtype=np.int32)]
+                )
+                cube_slice.in_window = np.concatenate(
+                    [old.in_window[keep], np.asarray(new_flag, dtype=bool)]
+                )
+                for m in self.measures:
+                    cube_slice.values[m] = np.concatenate(
+                        [old.values[m][keep], np.asarray(new_values[m], dtype=np.float64)]
+                    )
+            else:
+                cube_slice.code_idx = np.asarray(new_code, dtype=np.int32)
+                cube_slice.month_idx = np.asarray(new_month, dtype=np.int32)
+                cube_slice.in_window = np.asarray(new_flag, dtype=bool)
+                for m in self.measures:
+                    cube_slice.values[m] = np.asarray(new_values[m], dtype=np.float64)
+
+            slices[dim] = cube_slice
+
+        return slices
@@ -0,0 +1,365 @@
+# telemetry.py
+import argparse
+import hashlib
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    ("ts", "REAL"),
+    ("question_hash", "TEXT"),
+    ("plan_signature", "TEXT"),
+    ("metric", "TEXT"),
+    ("dimensions", "TEXT"),
+    ("time_window", "TEXT"),
+    ("engine", "TEXT"),
+    ("latency_ms", "REAL"),
+    ("cache_hit", "INTEGER"),
+    ("bytes_processed", "INTEGER"),
+    ("bytes_billed", "INTEGER"),
+    ("slot_ms", "INTEGER"),
+    ("row_count", "INTEGER"),
+    # 1 / sample rate: each stored event stands for this many executions
+    ("weight", "REAL"),
+    # canonical intent (JSON) of single-question plans; feeds the pre-warm list
+    ("intent", "TEXT"),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+
+# Suggestion thresholds used by report()
+PREWARM_MIN_CALLS = 3
+PREWARM_MIN_P95_MS = 1000.0
+PREWARM_MAX_HIT_RATIO = 0.5
+MATERIALIZE_MIN_CALLS = 5
+MATERIALIZE_MIN_BYTES = 1024 ** 3
+
+# After the writer fails to open the database, events are dropped (and
+# counted) for this long before it tries again
+RECONNECT_SECONDS = 30.0
+
+
+def question_hash(question: str) -> str:
+    normalized = " ".join(question.lower().split())
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS query_events ({columns})")
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(query_events)")}
+    for name, kind in COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE query_events ADD COLUMN {name} {kind}")
+    conn.execute("CREATE INDEX IF NOT EXISTS query_events_ts ON query_events (ts)")
+    return conn
+
+
+class TelemetryStore:
+    """
+    Sampled, asynchronous query telemetry in a local SQLite file.
+
+    record() never blocks: events go onto a bounded queue drained by one
+    writer thread in batches. When the queue is full the event is dropped
+    and counted; so are batches the writer cannot store (the database
+    cannot be opened or written), so the queue keeps draining.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        queue_size: int = 10_000,
+        batch_size: int = 200,
+        flush_seconds: float = 2.0,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Counters are updated from request threads and the writer
+        self._counts_lock = threading.Lock()
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+
+    def record(self, **event) -> bool:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            self._count("sampled_out")
+            return False
+
+        event.setdefault("ts", time.time())
+        event["weight"] = 1.0 / self.sample_rate
+        self._ensure_writer()
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+        self._count("recorded")
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every queued event is handled, at most timeout seconds.
+        Returns False when events are still queued.
+        """
+        if self._thread is None:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = self._queue.all_tasks_done
+        with done:
+            while self._queue.unfinished_tasks:
+                if not self._thread.is_alive():
+                    return False
+                remaining = 1.0 if deadline is None else min(deadline - time.monotonic(), 1.0)
+                if remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counts_lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "recorded": self.recorded,
+                "sampled_out": self.sampled_out,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "written": self.written,
+                "queued": self._queue.qsize(),
+            }
+
+    def _count(self, name: str, n: int = 1):
+        with self._counts_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    # ------------------------------
+    # WRITER
+    # ------------------------------
+    def _ensure_writer(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="telemetry-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        conn: Optional[sqlite3.Connection] = None
+        retry_at = 0.0
+        placeholders = ", ".join("?" for _ in COLUMN_NAMES)
+        insert = f"INSERT INTO query_events ({', '.join(COLUMN_NAMES)}) VALUES ({placeholders})"
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                if conn is None and time.monotonic() >= retry_at:
+                    try:
+                        conn = connect(self.path)
+                    except Exception:
+                        retry_at = time.monotonic() + RECONNECT_SECONDS
+                        logger.exception(
+                            "Telemetry database %s unavailable; dropping events for %.0fs",
+                            self.path, RECONNECT_SECONDS,
+                        )
+                if conn is None:
+                    self._count("failed", len(batch))
+                    continue
+
+                conn.executemany(
+                    insert, [[e.get(name) for name in COLUMN_NAMES] for e in batch]
+                )
+                conn.commit()
+                self._count("written", len(batch))
+            except Exception:
+                self._count("failed", len(batch))
+                logger.exception("Telemetry write failed; dropped %d events", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+# ------------------------------
+# REPORT
+# ------------------------------
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def plan_stats(path: str, since_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Per-plan aggregates. Counts and byte totals are scaled by the sampling
+    weight, so they estimate real traffic.
+    """
+    conn = connect(path)
+    try:
+        where, args = "", []
+        if since_seconds:
+            where, args = "WHERE ts >= ?", [time.time() - since_seconds]
+        rows = conn.execute(
+            f"""
+            SELECT plan_signature, metric, dimensions, time_window, latency_ms,
+                   cache_hit, bytes_processed, bytes_billed, slot_ms, row_count, weight
+            FROM query_events {where}
+            """,
+            args,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    plans: Dict[str, Dict[str, Any]] = {}
+    for (signature, metric, dimensions, window, latency, hit,
+         processed, billed, slot_ms, row_count, weight) in rows:
+        plan = plans.setdefault(signature, {
+            "plan_signature": signature,
+            "metric": metric,
+            "dimensions": dimensions,
+            "time_window": window,
+            "calls": 0.0,
+            "hits": 0.0,
+            "bytes_billed": 0.0,
+            "bytes_processed": 0.0,
+            "slot_ms": 0.0,
+            "rows": 0.0,
+            "latencies": [],
+        })
+        weight = weight or 1.0
+        plan["calls"] += weight
+        plan["hits"] += weight * (hit or 0)
+        plan["bytes_billed"] += weight * (billed or 0)
+        plan["bytes_processed"] += weight * (processed or 0)
+        plan["slot_ms"] += weight * (slot_ms or 0)
+        plan["rows"] += weight * (row_count or 0)
+        plan["latencies"].append(latency or 0.0)
+
+    result = []
+    for plan in plans.values():
+        latencies = plan["latencies"]
+        calls = plan["calls"]
+        misses = calls - plan["hits"]
+        result.append({
+            "plan_signature": plan["plan_signature"],
+            "metric": plan["metric"],
+            "dimensions": plan["dimensions"],
+            "time_window": plan["time_window"],
+            "calls": round(calls),
+            "cache_hit_ratio": round(plan["hits"] / calls, 3) if calls else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50), 1),
+            "p95_ms": round(percentile(latencies, 0.95), 1),
+            "max_ms": round(max(latencies), 1) if latencies else 0.0,
+            "bytes_billed": round(plan["bytes_billed"]),
+            "bytes_processed": round(plan["bytes_processed"]),
+            "bytes_per_miss": round(plan["bytes_processed"] / misses) if misses else 0,
+            "slot_ms": round(plan["slot_ms"]),
+            "avg_rows": round(plan["rows"] / calls, 1) if calls else 0.0,
+        })
+    return result
+
+
+def report(path: str, limit: int = 10, since_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Top plans by cost (bytes billed) and by p95 latency, plus plans worth
+    pre-warming (slow, often missed) or materializing (repeated, expensive).
+    """
+    plans = plan_stats(path, since_seconds)
+
+    prewarm = [
+        p["plan_signature"] for p in plans
+        if p["calls"] >= PREWARM_MIN_CALLS
+        and p["p95_ms"] >= PREWARM_MIN_P95_MS
+        and p["cache_hit_ratio"] <= PREWARM_MAX_HIT_RATIO
+    ]
+    materialize = [
+        p["plan_signature"] for p in plans
+        if p["calls"] >= MATERIALIZE_MIN_CALLS
+        and p["bytes_processed"] >= MATERIALIZE_MIN_BYTES
+    ]
+
+    return {
+        "plans": len(plans),
+        "since_seconds": since_seconds,
+        "top_by_cost": sorted(plans, key=lambda p: p["bytes_billed"], reverse=True)[:limit],
+        "top_by_latency": sorted(plans, key=lambda p: p["p95_ms"], reverse=True)[:limit],
+        "suggestions": {"prewarm": prewarm, "materialize": materialize},
+    }
+
+
+def top_intents(
+    path: str, limit: int = 20, since_seconds: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """
+    Most frequent question plans (by weighted calls) as stored intents.
+    Written out as the pre-warm list new instances run after startup.
+    """
+    conn = connect(path)
+    try:
+        where, args = "WHERE intent IS NOT NULL", []
+        if since_seconds:
+            where += " AND ts >= ?"
+            args.append(time.time() - since_seconds)
+        rows = conn.execute(
+            f"""
+            SELECT intent, SUM(COALESCE(weight, 1)) AS calls
+            FROM query_events {where}
+            GROUP BY intent
+            ORDER BY calls DESC
+            LIMIT ?
+            """,
+            [*args, limit],
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return [{"intent": json.loads(intent), "calls": round(calls)} for intent, calls in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slow / expensive Spend agent plans")
+    parser.add_argument("db", help="telemetry SQLite file")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--since-hours", type=float, default=None)
+    parser.add_argument("--write-prewarm", help="write the top plans to this pre-warm list")
+    parser.add_argument("--top", type=int, default=20, help="plans in the pre-warm list")
+    args = parser.parse_args()
+
+    since = args.since_hours * 3600 if args.since_hours else None
+    if args.write_prewarm:
+        with open(args.write_prewarm, "w") as f:
+            json.dump(top_intents(args.db, limit=args.top, since_seconds=since), f, indent=2)
+    else:
+        print(json.dumps(report(args.db, limit=args.limit, since_seconds=since), indent=2))
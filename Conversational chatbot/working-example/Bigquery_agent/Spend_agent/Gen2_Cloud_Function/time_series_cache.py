@@ -0,0 +1,142 @@
+# time_series_cache.py
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + (month.month - 1) + months
+    year, m = divmod(index, 12)
+    return date(year, m + 1, 1)
+
+
+class _Series:
+    __slots__ = ("version", "buckets", "fingerprint")
+
+    def __init__(self):
+        self.version = ""
+        # month -> result rows for that month
+        self.buckets: Dict[date, List[Dict[str, Any]]] = {}
+        # month -> table content fingerprint when the bucket was fetched
+        self.fingerprint: Dict[date, Any] = {}
+
+
+class TimeSeriesCache:
+    """
+    Per-month result buckets for trend questions.
+
+    A series (metric, dimensions, filters) is stored as one bucket per
+    month. After a table change only months that are still open (the
+    latest open_months) or whose content fingerprint moved are re-queried;
+    the rest of the series is stitched from cached buckets.
+    Thread-safe; the least recently used series are dropped past max_series.
+    """
+
+    def __init__(self, open_months: int = 2, max_series: int = 200):
+        self.open_months = open_months
+        self.max_series = max_series
+
+        self._series: "OrderedDict[str, _Series]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.bucket_hits = 0
+        self.bucket_fetches = 0
+
+    def series(
+        self,
+        key: str,
+        version: str,
+        months: List[date],
+        fingerprint: Dict[date, Any],
+        fetch: Callable[[List[date]], List[Dict[str, Any]]],
+        info: Optional[Dict[str, Any]] = None,
+        max_rows: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Rows for the given months (ordered by period), fetching only stale
+        buckets. fetch(months) must return rows carrying a "period" date.
+        A fetch returning more than max_rows rows may be cut short, so its
+        buckets are used for this answer but not cached.
+        """
+        with self._lock:
+            entry = self._series.get(key)
+            if entry is None:
+                entry = _Series()
+            else:
+                self._series.move_to_end(key)
+            buckets = dict(entry.buckets)
+            stored = dict(entry.fingerprint)
+            same_version = entry.version == version
+
+        stale = self.stale_months(months, buckets, stored, fingerprint, same_version)
+
+        cacheable = True
+        if stale:
+            rows = fetch(stale)
+            cacheable = max_rows is None or len(rows) <= max_rows
+
+            fresh: Dict[date, List[Dict[str, Any]]] = {m: [] for m in stale}
+            for row in rows:
+                fresh.setdefault(month_start(row["period"]), []).append(row)
+
+            buckets.update(fresh)
+            for month in stale:
+                stored[month] = fingerprint.get(month)
+
+        if info is not None:
+            info.update({"months": len(months), "fetched_months": len(stale)})
+
+        result = [row for m in sorted(months) for row in buckets.get(m, ())]
+        if not cacheable:
+            return result
+
+        with self._lock:
+            entry.buckets, entry.fingerprint, entry.version = buckets, stored, version
+            self._series[key] = entry
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+            self.bucket_fetches += len(stale)
+            self.bucket_hits += len(months) - len(stale)
+
+        return result
+
+    def stale_months(
+        self,
+        months: List[date],
+        buckets: Dict[date, List[Dict[str, Any]]],
+        stored: Dict[date, Any],
+        fingerprint: Dict[date, Any],
+        same_version: bool,
+    ) -> List[date]:
+        missing = [m for m in months if m not in buckets]
+        if same_version:
+            return missing
+
+        latest = max(fingerprint) if fingerprint else None
+        open_from = add_months(latest, 1 - self.open_months) if latest else None
+
+        stale = set(missing)
+        for month in months:
+            if open_from is not None and month >= open_from:
+                stale.add(month)
+            elif stored.get(month) != fingerprint.get(month):
+                stale.add(month)
+        return sorted(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "buckets": sum(len(s.buckets) for s in self._series.values()),
+                "bucket_hits": self.bucket_hits,
+                "bucket_fetches": self.bucket_fetches,
+            }
@@ -0,0 +1,226 @@
+# value_dictionary.py
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9&]+")
+_RAW_TOKEN_RE = re.compile(r"[A-Za-z0-9&]+")
+
+# 'Acme' / "Acme" / curly quotes; apostrophes inside words are not quotes
+_QUOTED_RE = re.compile(
+    r"(?<!\w)[\"'\u201c\u2018]([^\"'\u201c\u201d\u2018\u2019]+)[\"'\u201d\u2019](?!\w)"
+)
+
+# Candidates (by shared trigram count) scored in full per lookup
+MAX_CANDIDATES = 25
+
+# Shorter values ("IT", "HR") are too ambiguous for fuzzy lookup; they match
+# only when quoted or written exactly as stored
+MIN_FUZZY_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ValueDictionary:
+    """
+    Distinct values of the filterable dimension columns, with a trigram
+    inverted index for fast fuzzy lookup of values mentioned in a question.
+    """
+
+    def __init__(
+        self,
+        table_id: str,
+        columns: List[str],
+        query_fn: Callable[[str], List[Dict[str, Any]]],
+        max_values_per_column: int = 100_000,
+        min_score: float = 0.6,
+        stopwords: Optional[Set[str]] = None,
+    ):
+        self.table_id = table_id
+        self.columns = columns
+        self.query_fn = query_fn
+        self.max_values_per_column = max_values_per_column
+        self.min_score = min_score
+        self.stopwords = stopwords or set()
+
+        self.version: str = ""
+        # Parallel lists: entry i = (column, raw value, normalized, trigrams)
+        self._columns: List[str] = []
+        self._values: List[str] = []
+        self._normalized: List[str] = []
+        self._grams: List[FrozenSet[str]] = []
+        self._index: Dict[str, List[int]] = {}
+        # normalized value -> entries, for quoted and exact matches
+        self._exact: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------
+    # LOAD
+    # ------------------------------
+    def load_sql(self) -> str:
+        structs = ", ".join(
+            f"STRUCT('{c}' AS col, CAST({c} AS STRING) AS value)" for c in self.columns
+        )
+        return f"""
+        SELECT col, value, COUNT(*) OVER (PARTITION BY col) AS col_values
+        FROM (
+            SELECT pair.col AS col, pair.value AS value
+            FROM `{self.table_id}`, UNNEST([{structs}]) AS pair
+            WHERE pair.value IS NOT NULL
+            GROUP BY col, value
+        )
+        """
+
+    def load(self, version: str):
+        rows = self.query_fn(self.load_sql())
+
+        columns, values, normalized, grams = [], [], [], []
+        index: Dict[str, List[int]] = {}
+        exact: Dict[str, List[int]] = {}
+        skipped = set()
+
+        for row in rows:
+            if row["col_values"] > self.max_values_per_column:
+                skipped.add(row["col"])
+                continue
+
+            norm = normalize(row["value"])
+            if not norm:
+                continue
+
+            i = len(values)
+            columns.append(row["col"])
+            values.append(row["value"])
+            normalized.append(norm)
+            exact.setdefault(norm, []).append(i)
+
+            fuzzy = len(norm) >= MIN_FUZZY_LENGTH and norm not in self.stopwords
+            g = trigrams(norm) if fuzzy else frozenset()
+            grams.append(g)
+            for gram in g:
+                index.setdefault(gram, []).append(i)
+
+        with self._lock:
+            self._columns, self._values = columns, values
+            self._normalized, self._grams = normalized, grams
+            self._index, self._exact = index, exact
+            self.version = version
+
+        if skipped:
+            logger.info("Value dictionary skipped high-cardinality columns: %s", sorted(skipped))
+        logger.info("Value dictionary loaded for %s: %d values", version, len(values))
+
+    # ------------------------------
+    # LOOKUP
+    # ------------------------------
+    def match(
+        self, question: str, columns: Optional[List[str]] = None
+    ) -> Optional[Tuple[str, str, float]]:
+        """
+        Best (column, value, score) mentioned in the question, or None.
+        Restricted to the given columns when provided. A quoted value, or a
+        short one written exactly as stored, matches verbatim (score 1.0)
+        before any fuzzy scoring.
+        """
+        with self._lock:
+            index, grams, exact = self._index, self._grams, self._exact
+            cols, values, normalized = self._columns, self._values, self._normalized
+
+        if not exact:
+            return None
+
+        def allowed(i: int) -> bool:
+            return columns is None or cols[i] in columns
+
+        quoted = {normalize(text) for text in _QUOTED_RE.findall(question)}
+        for text in sorted(quoted, key=len, reverse=True):
+            for i in exact.get(text, ()):
+                if allowed(i):
+                    return cols[i], values[i], 1.0
+
+        for token in _RAW_TOKEN_RE.findall(question):
+            if len(token) >= MIN_FUZZY_LENGTH:
+                continue
+            for i in exact.get(token.lower(), ()):
+                if allowed(i) and values[i].strip() == token:
+                    return cols[i], values[i], 1.0
+
+        # Spans come from every question word (values may contain intent
+        # words: "Ten Pines"); spans made only of stopwords are skipped
+        words = normalize(question).split()
+        if not words or all(w in self.stopwords for w in words):
+            return None
+
+        overlap: Counter = Counter()
+        for gram in trigrams(" ".join(words)):
+            for i in index.get(gram, ()):
+                overlap[i] += 1
+
+        best: Optional[Tuple[str, str, float]] = None
+        best_key = (0.0, 0)
+        for i, _ in overlap.most_common(MAX_CANDIDATES):
+            if not allowed(i):
+                continue
+
+            score = self._best_span_score(
+                words, normalized[i], grams[i], quoted, self.stopwords
+            )
+            key = (score, len(normalized[i]))
+            if score >= self.min_score and key > best_key:
+                best_key = key
+                best = (cols[i], values[i], round(score, 3))
+
+        return best
+
+    @staticmethod
+    def _best_span_score(
+        words: List[str],
+        value: str,
+        value_grams: FrozenSet[str],
+        quoted: Set[str],
+        stopwords: Set[str],
+    ) -> float:
+        """
+        Best trigram similarity between any question span and the value.
+        Spans shorter than the value are also compared with the value's
+        leading words, so "acme corp" matches "Acme Corp International".
+        A single leading word is too weak a hint ("top ten" is not "Ten
+        Pines") unless the question quotes it: 'acme'. Spans of stopwords
+        only ("top ten suppliers") never match.
+        """
+        value_words = value.split()
+        width = len(value_words)
+        best = 0.0
+        for n in range(1, width + 2):
+            target = value_grams if n >= width else trigrams(" ".join(value_words[:n]))
+            for start in range(0, max(len(words) - n + 1, 0)):
+                span_words = words[start:start + n]
+                if all(w in stopwords for w in span_words):
+                    continue
+                text = " ".join(span_words)
+                if n == 1 < width and text not in quoted:
+                    continue
+                span = trigrams(text)
+                score = jaccard(span, target)
+                if n < width:
+                    # Partial (prefix) matches rank just below full ones
+                    score *= 0.95
+                best = max(best, score)
+        return best